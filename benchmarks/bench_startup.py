@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must stay off the startup path; they are imported lazily where needed
+HEAVY_MODULES = ["numpy", "scipy", "sklearn", "requests", "bs4"]
+
+
+def parse_importtime(stderr):
+    """Parse `python -X importtime` output into (module, self_us, cumulative_us) tuples."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure_importtime(module="bookmarks"):
+    """Return the import-time breakdown of importing `module` in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = parse_importtime(result.stderr)
+    top_level = [row for row in rows if row[0] == module]
+    loaded = {name.split(".")[0] for name, _, _ in rows}
+    return {
+        "module": module,
+        "cumulative_ms": top_level[-1][2] / 1000.0 if top_level else None,
+        "slowest_imports": [
+            {"module": name, "self_ms": self_us / 1000.0, "cumulative_ms": cumulative_us / 1000.0}
+            for name, self_us, cumulative_us in sorted(rows, key=lambda row: row[1], reverse=True)[:10]
+        ],
+        "heavy_modules_loaded": sorted(name for name in HEAVY_MODULES if name in loaded),
+    }
+
+
+def measure_wall_time(args, repeat=5):
+    """Median wall-clock seconds to run the script with `args` in a fresh interpreter."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=REPO_ROOT, capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def run(repeat=5):
+    return {
+        "benchmark": "startup",
+        "python": sys.version.split()[0],
+        "import_bookmarks": measure_importtime("bookmarks"),
+        "help_wall_seconds": measure_wall_time(["bookmarks.py", "--help"], repeat),
+        "interpreter_wall_seconds": measure_wall_time(["-c", "pass"], repeat),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure CLI startup time with python -X importtime.")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per wall-clock measurement")
+    args = parser.parse_args()
+    json.dump(run(args.repeat), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,471 @@
+import argparse
+import html
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Works per listing page, as on AO3
+PAGE_SIZE = 20
+
+FANDOMS = [
+    "Good Omens (TV)", "Star Wars - All Media Types", "Harry Potter - J. K. Rowling",
+    "The Locked Tomb Series | Gideon the Ninth Series - Tamsyn Muir", "Marvel Cinematic Universe", "Sherlock (TV)",
+    "Critical Role (Web Series)", "Our Flag Means Death (TV)", "Stardew Valley (Video Game)", "Genshin Impact (Video Game)",
+]
+FREEFORMS = [
+    "Fluff", "Angst", "Hurt/Comfort", "Slow Burn", "Enemies to Lovers", "Found Family",
+    "Alternate Universe - Coffee Shops & Cafés", "Pining", "Mutual Pining", "Domestic Fluff", "Post-Canon",
+    "Canon Divergence", "Time Travel", "Fix-It", "Banter", "Humor", "Friends to Lovers", "Getting Together",
+    "Happy Ending", "Introspection", "Whump", "Emotional Hurt/Comfort", "Soulmates", "Fake/Pretend Relationship",
+    "Road Trips", "Magic", "Worldbuilding", "Case Fic", "Slice of Life", "Hand Holding", "Light Angst",
+    "Alternate Universe - Modern Setting", "Alternate Universe - Canon Divergence", "Hurt No Comfort",
+    "Character Study", "Hopeful Ending", "Holidays", "Bed Sharing", "Mystery", "Nightmares",
+]
+CHARACTERS = [
+    "Aziraphale (Good Omens)", "Crowley (Good Omens)", "Obi-Wan Kenobi", "Anakin Skywalker", "Harry Potter",
+    "Draco Malfoy", "Gideon Nav", "Harrowhark Nonagesimus", "Steve Rogers", "Bucky Barnes",
+    "Sherlock Holmes", "John Watson", "Edward Teach", "Stede Bonnet",
+]
+# Wrangling served on tag pages: every freeform above is canonical, these are synonyms of them
+TAG_SYNONYMS = {
+    "Hurt/Comfort": ["hurt/comfort", "H/C", "Hurt & Comfort"],
+    "Fluff": ["fluff", "Fluffy"],
+    "Found Family": ["found family", "Chosen Family"],
+    "Enemies to Lovers": ["enemies to lovers", "Enemies To Lovers", "rivals to lovers"],
+    "Alternate Universe - Coffee Shops & Cafés": ["Coffee Shop AU", "coffee shop au"],
+    "Alternate Universe - Modern Setting": ["Modern AU", "modern au"],
+    "Slow Burn": ["slowburn", "Slow burn"],
+}
+META_TAGS = {
+    "Emotional Hurt/Comfort": ["Hurt/Comfort"],
+    "Mutual Pining": ["Pining"],
+    "Domestic Fluff": ["Fluff"],
+    "Light Angst": ["Angst"],
+    "Alternate Universe - Canon Divergence": ["Canon Divergence"],
+}
+CANONICAL_TAGS = {synonym.lower(): tag for tag, synonyms in TAG_SYNONYMS.items() for synonym in synonyms}
+CANONICAL_TAGS.update({tag.lower(): tag for tag in FREEFORMS})
+TAG_URL_ESCAPES = {"*s*": "/", "*a*": "&", "*d*": ".", "*q*": "?", "*h*": "#"}
+WORDS = ("the a quiet storm letters after war home found again light dark winter summer sea road stars night "
+         "morning ghost promise kitchen library garden train river letter sword crown").split()
+
+
+def make_work(work_id, seed=0, extra_tags=()):
+    """Deterministically generate the work with the given id; extra_tags are added to its freeforms."""
+    rng = random.Random(seed * 1_000_003 + work_id)
+    hits = int(rng.lognormvariate(8, 1.5)) + 1
+    kudos = int(hits * rng.uniform(0.01, 0.15))
+    freeforms = rng.sample(FREEFORMS, rng.randint(3, 10))
+    freeforms += [tag for tag in extra_tags if tag not in freeforms]
+    return {
+        "id": work_id,
+        "title": " ".join(rng.sample(WORDS, 3)).title(),
+        "author": f"writer{rng.randint(1, 50000)}",
+        "fandom": rng.choice(FANDOMS),
+        "characters": rng.sample(CHARACTERS, 2),
+        "freeforms": freeforms,
+        "summary": " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60))).capitalize() + ".",
+        "words": rng.randint(500, 200000),
+        "hits": hits,
+        "kudos": kudos,
+        "bookmarks": int(kudos * rng.uniform(0.0, 0.3)),
+    }
+
+
+def render_tags(work):
+    tags = ['<li class="warnings"><strong><a class="tag" href="/tags/No%20Archive%20Warnings%20Apply/works">'
+            'No Archive Warnings Apply</a></strong></li>',
+            f'<li class="relationships"><a class="tag" href="/tags/x/works">'
+            f'{html.escape("/".join(work["characters"]))}</a></li>']
+    tags += [f'<li class="characters"><a class="tag" href="/tags/x/works">{html.escape(name)}</a></li>'
+             for name in work["characters"]]
+    tags += [f'<li class="freeforms"><a class="tag" href="/tags/x/works">{html.escape(tag)}</a></li>'
+             for tag in work["freeforms"]]
+    return "\n    ".join(tags)
+
+
+def render_stats(work):
+    return f'''<dl class="stats">
+    <dt class="language">Language:</dt>
+    <dd class="language" lang="en">English</dd>
+    <dt class="words">Words:</dt>
+    <dd class="words">{work["words"]:,}</dd>
+    <dt class="kudos">Kudos:</dt>
+    <dd class="kudos"><a href="/works/{work["id"]}/kudos">{work["kudos"]:,}</a></dd>
+    <dt class="bookmarks">Bookmarks:</dt>
+    <dd class="bookmarks"><a href="/works/{work["id"]}/bookmarks">{work["bookmarks"]:,}</a></dd>
+    <dt class="hits">Hits:</dt>
+    <dd class="hits">{work["hits"]:,}</dd>
+  </dl>'''
+
+
+def render_blurb(work):
+    return f'''<li id="work_{work["id"]}" class="work blurb group work-{work["id"]}" role="article">
+  <div class="header module">
+    <h4 class="heading">
+      <a href="/works/{work["id"]}">{html.escape(work["title"])}</a>
+      by
+      <a rel="author" href="/users/{work["author"]}/pseuds/{work["author"]}">{work["author"]}</a>
+    </h4>
+    <h5 class="fandoms heading">
+      <span class="landmark">Fandoms:</span>
+      <a class="tag" href="/tags/x/works">{html.escape(work["fandom"])}</a>
+    </h5>
+  </div>
+  <h6 class="landmark heading">Tags</h6>
+  <ul class="tags commas">
+    {render_tags(work)}
+  </ul>
+  <h6 class="landmark heading">Summary</h6>
+  <blockquote class="userstuff summary">
+    <p>{work["summary"]}</p>
+  </blockquote>
+  {render_stats(work)}
+</li>'''
+
+
+def render_pagination(page, n_pages):
+    if n_pages <= 1:
+        return ""
+    # Like AO3: the first, last and nearby page numbers, with gaps elided
+    shown = sorted({1, 2, n_pages - 1, n_pages, page - 1, page, page + 1} & set(range(1, n_pages + 1)))
+    items = []
+    for i, number in enumerate(shown):
+        if i and number > shown[i - 1] + 1:
+            items.append('<li class="gap">&hellip;</li>')
+        if number == page:
+            items.append(f'<li><span class="current">{number}</span></li>')
+        else:
+            items.append(f'<li><a href="?page={number}">{number}</a></li>')
+    if page < n_pages:
+        items.append(f'<li class="next" title="next"><a rel="next" href="?page={page + 1}">Next &#8594;</a></li>')
+    return ('<ol class="pagination actions" role="navigation" title="pagination">\n  '
+            + "\n  ".join(items) + "\n</ol>")
+
+
+def render_page(title, body):
+    return f'''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)} | Archive of Our Own</title>
+</head>
+<body class="logged-out">
+<div id="outer" class="wrapper">
+<div id="main" class="region" role="main">
+{body}
+</div>
+</div>
+</body>
+</html>
+'''
+
+
+def render_listing(title, works, page, n_pages, total):
+    start = (page - 1) * PAGE_SIZE + 1
+    heading = f"{start} - {start + len(works) - 1} of {total:,} Works" if works else "0 Works"
+    body = (f'<h2 class="heading">{html.escape(heading)}</h2>\n<ol class="work index group">\n'
+            + "\n".join(render_blurb(work) for work in works) + "\n</ol>\n" + render_pagination(page, n_pages))
+    return render_page(title, body)
+
+
+def render_bookmark(work, user):
+    """A work's blurb as it appears in user's bookmarks, with their own tags and notes."""
+    rng = random.Random(zlib.crc32(f"{user}:{work['id']}".encode("utf-8")))
+    blurb = render_blurb(work).replace(f'<li id="work_{work["id"]}" class="work blurb group work-{work["id"]}"',
+                                       f'<li id="bookmark_{work["id"]}" class="bookmark blurb group"', 1)
+    tags = "".join(f'<li><a class="tag" href="/tags/x/bookmarks">{html.escape(tag)}</a></li>'
+                   for tag in rng.sample(["favourite", "reread", "to read", "comfort fic", "crying"], 2))
+    rec = '<p class="status"><span class="rec" title="Rec">Rec</span></p>' if rng.random() < 0.2 else ""
+    notes = " ".join(rng.choice(WORDS) for _ in range(8))
+    user_module = f'''  <div class="user module group">
+    <h5 class="byline heading">Bookmarked by <a href="/users/{user}/pseuds/{user}/bookmarks">{user}</a></h5>
+    {rec}
+    <h6 class="landmark heading">Bookmarker's Tags:</h6>
+    <ul class="meta tags commas">{tags}</ul>
+    <h6 class="landmark heading">Bookmarker's Notes</h6>
+    <blockquote class="userstuff notes"><p>{notes}</p></blockquote>
+  </div>
+</li>'''
+    return blurb[:-len("</li>")] + user_module
+
+
+def render_chapters(work, full):
+    """The chapter text of a work with about work["words"] words (only chapter 1 unless full)."""
+    rng = random.Random(work["id"] * 7919 + 1)
+    n_chapters = min(work["words"] // 4000 + 1, 40)
+    chapters = []
+    for chapter in range(1, (n_chapters if full else 1) + 1):
+        words = work["words"] // n_chapters
+        paragraphs = "\n".join("<p>" + html.escape(" ".join(rng.choice(WORDS) for _ in range(min(80, words - i))))
+                                + "</p>" for i in range(0, words, 80))
+        chapters.append(f'''<div class="chapter" id="chapter-{chapter}">
+  <div class="chapter preface group" role="complementary">
+    <h3 class="title"><a href="/works/{work["id"]}/chapters/{chapter}">Chapter {chapter}</a>: {rng.choice(WORDS)}</h3>
+    <div id="summary" class="summary module"><blockquote class="userstuff"><p>Chapter summary.</p></blockquote></div>
+  </div>
+  <div class="userstuff module" role="article">
+    <h3 class="landmark heading" id="work">Chapter Text</h3>
+{paragraphs}
+  </div>
+</div>''')
+    return '<div id="chapters" role="article">\n' + "\n".join(chapters) + "\n</div>"
+
+
+def render_work_page(work, full=False):
+    body = f'''<dl class="work meta group">
+  <dt class="fandom tags">Fandom:</dt>
+  <dd class="fandom tags"><h5 class="fandoms heading"><a class="tag" href="/tags/x/works">{html.escape(work["fandom"])}</a></h5></dd>
+  <dt class="freeform tags">Additional Tags:</dt>
+  <dd class="freeform tags">
+  <ul class="tags commas">
+    {render_tags(work)}
+  </ul>
+  </dd>
+  <dt class="stats">Stats:</dt>
+  <dd class="stats">
+  {render_stats(work)}
+  </dd>
+</dl>
+<div id="workskin">
+  <div class="preface group">
+    <h2 class="title heading">{html.escape(work["title"])}</h2>
+    <h3 class="byline heading"><a rel="author" href="/users/{work["author"]}/pseuds/{work["author"]}">{work["author"]}</a></h3>
+    <div class="summary module">
+      <h3 class="heading">Summary:</h3>
+      <blockquote class="userstuff"><p>{work["summary"]}</p></blockquote>
+    </div>
+  </div>
+  {render_chapters(work, full)}
+</div>'''
+    return render_page(work["title"], body)
+
+
+def render_tag_list(kind, heading, tags):
+    if not tags:
+        return ""
+    items = "".join(f'<li><a class="tag" href="/tags/x">{html.escape(tag)}</a></li>' for tag in tags)
+    return (f'<div class="{kind} listbox group"><h3 class="heading">{heading}</h3>'
+            f'<ul class="tags commas index group">{items}</ul></div>')
+
+
+def render_tag_page(name):
+    """A freeform tag's page with its wrangling, or None for a tag the archive doesn't know."""
+    canonical = CANONICAL_TAGS.get(name.lower())
+    if canonical is None:
+        return None
+    if canonical.lower() != name.lower():
+        body = (f'<div class="tag home profile"><h2 class="heading">{html.escape(name)}</h2>'
+                '<p>This tag belongs to the Additional Tags Category.</p>'
+                f'<div class="merger module"><p>This tag has been made a synonym of '
+                f'<a class="tag" href="/tags/x">{html.escape(canonical)}</a>.</p></div></div>')
+    else:
+        body = (f'<div class="tag home profile"><h2 class="heading">{html.escape(canonical)}</h2>'
+                "<p>This tag belongs to the Additional Tags Category. It's a canonical tag. "
+                "You can use it to filter works and to filter bookmarks.</p>"
+                + render_tag_list("parent", "Parent tags (more general):", ["No Fandom"])
+                + render_tag_list("meta", "Metatags:", META_TAGS.get(canonical, []))
+                + render_tag_list("synonym", "Tags with the same meaning:", TAG_SYNONYMS.get(canonical, []))
+                + "</div>")
+    return render_page(name, body)
+
+
+def parse_latency(spec):
+    """
+    Turn a latency spec into a function returning a delay in seconds:
+    "0", "constant:MS", "uniform:LOW_MS,HIGH_MS" or "lognormal:MEDIAN_MS,SIGMA".
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",")] if params else []
+    if kind in ("0", "none"):
+        return lambda rng: 0.0
+    if kind == "constant" and len(values) == 1:
+        return lambda rng: values[0] / 1000.0
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000.0
+    if kind == "lognormal" and len(values) == 2:
+        median, sigma = values
+        return lambda rng: median / 1000.0 * rng.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency spec: {spec!r}")
+
+
+class FakeAO3:
+    """
+    Local stand-in for AO3 that generates pages on the fly, so no listing is ever stored in memory:
+    every collection, author and user's bookmarks hold n_works deterministic works, work pages
+    exist for ids 0 .. n_works - 1 (with generated chapter text), searches return works carrying the requested freeform tags (fewer the
+    more tags are requested), and freeform tag pages show the wrangling in TAG_SYNONYMS and
+    META_TAGS. Each response is delayed by a draw from `latency` (see parse_latency) and fails
+    with a random status from error_statuses with probability error_rate; 429s carry a
+    Retry-After header. Use as a context manager; `base_url` is the address to fetch from.
+    """
+
+    def __init__(self, n_works=10000, latency="0", error_rate=0.0, error_statuses=(429, 503), retry_after=1,
+                 seed=0, host="127.0.0.1", port=0):
+        if not 1 <= n_works <= 1_000_000:
+            raise ValueError("n_works must be between 1 and 1,000,000")
+        self.n_works = n_works
+        self.delay = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.seed = seed
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self))
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def draw(self):
+        """Return (delay_seconds, error_status or None) for the next response."""
+        with self._lock:
+            self.requests += 1
+            delay = self.delay(self._rng)
+            error = None
+            if self.error_statuses and self._rng.random() < self.error_rate:
+                error = self._rng.choice(self.error_statuses)
+                self.errors += 1
+        return delay, error
+
+    def _page(self, query, total):
+        n_pages = max((total + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+        try:
+            page = int(query.get("page", ["1"])[0])
+        except ValueError:
+            page = 1
+        return min(max(page, 1), n_pages), n_pages
+
+    def listing(self, key, query, title):
+        """A listing of all n_works works, shuffled deterministically per collection or author."""
+        page, n_pages = self._page(query, self.n_works)
+        offset = zlib.crc32(key.encode("utf-8")) % self.n_works
+        start = (page - 1) * PAGE_SIZE
+        ids = [(offset + i) % self.n_works for i in range(start, min(start + PAGE_SIZE, self.n_works))]
+        works = [make_work(work_id, self.seed) for work_id in ids]
+        return render_listing(title, works, page, n_pages, self.n_works)
+
+    def bookmarks(self, user, query):
+        """A user's bookmarks: n_works works, shuffled deterministically per user."""
+        page, n_pages = self._page(query, self.n_works)
+        offset = zlib.crc32(f"bookmarks:{user}".encode("utf-8")) % self.n_works
+        start = (page - 1) * PAGE_SIZE
+        ids = [(offset + i) % self.n_works for i in range(start, min(start + PAGE_SIZE, self.n_works))]
+        body = (f'<h2 class="heading">{start + 1} - {start + len(ids)} of {self.n_works:,} Bookmarks by {user}</h2>\n'
+                '<ol class="bookmark index group">\n'
+                + "\n".join(render_bookmark(make_work(work_id, self.seed), user) for work_id in ids)
+                + "\n</ol>\n" + render_pagination(page, n_pages))
+        return render_page(f"{user} - Bookmarks", body)
+
+    def search(self, query):
+        tags = [tag.strip() for tag in query.get("work_search[freeform_names]", [""])[0].split(",") if tag.strip()]
+        # Each extra tag narrows the results, as an AND search does
+        total = max(self.n_works >> (2 * len(tags)), 1 if self.n_works else 0)
+        page, n_pages = self._page(query, total)
+        key = zlib.crc32(",".join(sorted(set(tags))).encode("utf-8"))
+        start = (page - 1) * PAGE_SIZE
+        works = []
+        for i in range(start, min(start + PAGE_SIZE, total)):
+            work_id = random.Random(key * 1_000_003 + i).randrange(self.n_works)
+            works.append(make_work(work_id, self.seed, tags))
+        return render_listing("Search Results", works, page, n_pages, total)
+
+    def route(self, url):
+        """Return (status, html) for a request path."""
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        match = re.fullmatch(r"/collections/([^/]+)/works", parts.path)
+        if match:
+            return 200, self.listing(f"collection:{match.group(1)}", query, f"Works in {match.group(1)}")
+        match = re.fullmatch(r"/users/([^/]+)/works", parts.path)
+        if match:
+            return 200, self.listing(f"user:{match.group(1)}", query, f"Works by {match.group(1)}")
+        match = re.fullmatch(r"/users/([^/]+)/bookmarks", parts.path)
+        if match:
+            return 200, self.bookmarks(match.group(1), query)
+        if parts.path == "/works/search":
+            return 200, self.search(query)
+        match = re.fullmatch(r"/tags/([^/]+)", parts.path)
+        if match:
+            name = unquote(match.group(1))
+            for escape, char in TAG_URL_ESCAPES.items():
+                name = name.replace(escape, char)
+            page = render_tag_page(name)
+            if page is not None:
+                return 200, page
+        match = re.fullmatch(r"/works/(\d+)", parts.path)
+        if match and int(match.group(1)) < self.n_works:
+            full = query.get("view_full_work", [""])[0] == "true"
+            return 200, render_work_page(make_work(int(match.group(1)), self.seed), full)
+        return 404, render_page("Not Found", "<h2>Error 404</h2>")
+
+
+def make_handler(fake):
+    class FakeAO3Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            delay, error = fake.draw()
+            if delay:
+                time.sleep(delay)
+            if error is not None:
+                status, body = error, render_page("Error", f"<h2>Error {error}</h2>")
+            else:
+                status, body = fake.route(self.path)
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            if status == 429:
+                self.send_header("Retry-After", str(fake.retry_after))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return FakeAO3Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic AO3 stand-in for scale and load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--works", type=int, default=10000, help="works per collection and author (1 to 1,000,000)")
+    parser.add_argument("--latency", default="0",
+                        help='"constant:MS", "uniform:LOW_MS,HIGH_MS" or "lognormal:MEDIAN_MS,SIGMA"')
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of responses that fail")
+    parser.add_argument("--error-status", type=int, nargs="+", default=[429, 503], help="statuses to fail with")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    fake = FakeAO3(args.works, args.latency, args.error_rate, args.error_status, args.retry_after, args.seed,
+                   args.host, args.port)
+    print(f"Serving a fake AO3 with {args.works:,} works on {fake.base_url}")
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.httpd.server_close()
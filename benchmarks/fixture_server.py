@@ -0,0 +1,73 @@
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+NEXT_LINK = re.compile(r'\s*<li class="next".*?</li>', re.S)
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def make_handler(fixtures, pages):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_html(self, status, body):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _listing(self, name, query):
+            page = int(query.get("page", ["1"])[0])
+            body = fixtures[name].replace("?page=2", f"?page={page + 1}")
+            if page >= pages:
+                body = NEXT_LINK.sub("", body)
+            return body
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            if re.fullmatch(r"/collections/[^/]+/works", url.path):
+                self._send_html(200, self._listing("collection_works.html", query))
+            elif url.path == "/works/search" or re.fullmatch(r"/users/[^/]+/works", url.path):
+                self._send_html(200, self._listing("search_results.html", query))
+            elif re.fullmatch(r"/works/\d+", url.path):
+                self._send_html(200, fixtures["work.html"])
+            else:
+                self._send_html(404, "<html><body>Not found</body></html>")
+
+    return FixtureHandler
+
+
+class FixtureServer:
+    """
+    Serve the synthetic pages in fixtures/ on a local port in a background thread, standing in
+    for AO3: collection and search listings are `pages` pages long, every work URL returns the
+    fixture work page. Use as a context manager; `base_url` is the address to fetch from.
+    """
+
+    def __init__(self, pages=5, host="127.0.0.1", port=0):
+        fixtures = {name: load_fixture(name) for name in os.listdir(FIXTURES_DIR) if name.endswith(".html")}
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(fixtures, pages))
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
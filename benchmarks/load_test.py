@@ -0,0 +1,196 @@
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import bookmarks
+from crawl_queue import CrawlQueue
+from fake_ao3 import FREEFORMS, FakeAO3, make_work
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    if not timings:
+        return {}
+    return {f"p{p}": timings[min(len(timings) - 1, int(len(timings) * p / 100))] for p in (50, 90, 99)}
+
+
+def crawl(fake, n_collections, max_pages, concurrency):
+    """Crawl n_collections collections concurrently; report pages and works per second."""
+    start = time.perf_counter()
+    works = sum(1 for _ in bookmarks.iter_collections_works(
+        [f"collection{i}" for i in range(n_collections)], concurrency, max_pages, fake.base_url))
+    seconds = time.perf_counter() - start
+    return {"collections": n_collections, "concurrency": concurrency, "works": works,
+            "requests": fake.requests, "injected_errors": fake.errors, "seconds": seconds,
+            "pages_per_second": (fake.requests - fake.errors) / seconds, "works_per_second": works / seconds}
+
+
+def search_burst(fake, n_searches, concurrency):
+    """Fire n_searches uncached tag searches from `concurrency` threads; report throughput and latency."""
+    queries = [[FREEFORMS[(i + j * 7) % len(FREEFORMS)] for j in range(1 + i % 4)] for i in range(n_searches)]
+
+    def search(tags):
+        start = time.perf_counter()
+        result = bookmarks.fetch_search_page(tags, cache=None, base_url=fake.base_url)
+        return time.perf_counter() - start, result is not None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(search, queries))
+    seconds = time.perf_counter() - start
+    return {"searches": n_searches, "concurrency": concurrency, "failed": sum(not ok for _, ok in results),
+            "requests": fake.requests, "injected_errors": fake.errors, "seconds": seconds,
+            "searches_per_second": n_searches / seconds,
+            "latency_seconds": percentiles([timing for timing, _ in results])}
+
+
+def scale(sizes, max_pages):
+    """Crawl the first pages of a collection and fetch the last work at each archive size."""
+    results = []
+    for n_works in sizes:
+        with FakeAO3(n_works=n_works) as fake:
+            start = time.perf_counter()
+            works = list(bookmarks.get_collection_works("scale", max_pages, fake.base_url))
+            crawl_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            info = bookmarks.extract_work_info(f"https://archiveofourown.org/works/{n_works - 1}", fake.base_url)
+            results.append({"works": n_works, "crawled": len(works), "crawl_seconds": crawl_seconds,
+                            "work_page_seconds": time.perf_counter() - start, "work_page_ok": info is not None})
+    return results
+
+
+def recommend(fake, n_works, n_topics):
+    """End-to-end recommendation latency for a reader with n_works bookmarked works, cache disabled."""
+    works = []
+    for work_id in range(n_works):
+        work = make_work(work_id)
+        works.append({"link": f"https://archiveofourown.org/works/{work_id}", "title": work["title"],
+                      "author": work["author"], "tags": work["freeforms"], "fandom": work["fandom"],
+                      "summary": work["summary"], "hits": work["hits"], "kudos": work["kudos"],
+                      "bookmarks": work["bookmarks"]})
+    bookmarks.SEARCH_CACHE.enabled = False
+    start = time.perf_counter()
+    recommendations = bookmarks.recommend_works_by_tags(works, n_topics=n_topics, n_recommendations=10,
+                                                        base_url=fake.base_url)
+    seconds = time.perf_counter() - start
+    return {"works": n_works, "recommendations": len(recommendations), "requests": fake.requests,
+            "injected_errors": fake.errors, "seconds": seconds}
+
+
+@contextlib.contextmanager
+def fake_ao3_process(n_works, latency):
+    """
+    Run fake_ao3.py in a process of its own and yield its base URL, for scenarios whose own worker
+    processes could outpace an in-process server sharing the parent's GIL.
+    """
+    server = subprocess.Popen([sys.executable, "-u", os.path.join(BENCH_DIR, "fake_ao3.py"), "--port", "0",
+                               "--works", str(n_works), "--latency", latency],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        # The server prints its address once it is listening
+        line = server.stdout.readline()
+        if not line:
+            raise RuntimeError("fake_ao3.py exited before serving")
+        yield line.split()[-1]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def queue_crawl(base_url, process_counts, n_collections, max_pages, threads):
+    """Drain the same crawl from a fresh job queue with each number of worker processes; report pages per second."""
+    results = []
+    for n_processes in process_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "queue.sqlite3")
+            CrawlQueue(path).push_many([f"https://archiveofourown.org/collections/queue{i}/works"
+                                        for i in range(n_collections)], "collection")
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=n_processes) as executor:
+                futures = [executor.submit(bookmarks.crawl_worker, path, threads, max_pages=max_pages,
+                                           base_url=base_url, poll_seconds=0.1) for _ in range(n_processes)]
+                jobs = sum(future.result() for future in futures)
+            seconds = time.perf_counter() - start
+            # The server runs elsewhere, so count its requests as the queue's fetch attempts
+            with contextlib.closing(sqlite3.connect(path)) as connection:
+                requests = connection.execute("SELECT SUM(attempts) FROM jobs").fetchone()[0] or 0
+        results.append({"processes": n_processes, "threads": threads, "jobs": jobs,
+                        "requests": requests, "seconds": seconds, "pages_per_second": jobs / seconds})
+    return results
+
+
+def crawl_scenario(args):
+    # Many collections crawled at once over a realistically slow link
+    with FakeAO3(args.works, args.latency) as fake:
+        return crawl(fake, 8, 5, args.concurrency)
+
+
+def flaky_crawl_scenario(args):
+    # The same crawl while 20% of responses are rate limited or unavailable, exercising retries and backoff
+    with FakeAO3(args.works, args.latency, error_rate=0.2, retry_after=0) as fake:
+        return crawl(fake, 8, 5, args.concurrency)
+
+
+def queue_crawl_scenario(args):
+    # The crawl run by 1, 2 and 4 worker processes sharing one job queue, against a server in its own process
+    with fake_ao3_process(args.works, args.latency) as base_url:
+        return {"runs": queue_crawl(base_url, [1, 2, 4], 8, 5, 2)}
+
+
+def search_burst_scenario(args):
+    # A burst of concurrent uncached searches, as when several recommendations start together
+    with FakeAO3(args.works, args.latency) as fake:
+        return search_burst(fake, 200, args.concurrency)
+
+
+def scale_scenario(args):
+    # Listing and work-page cost from a one-work archive up to a million works
+    return {"sizes": scale([1, 1000, 100_000, 1_000_000], 3)}
+
+
+def recommend_scenario(args):
+    # A whole recommendation against a slow, occasionally failing archive
+    with FakeAO3(args.works, args.latency, error_rate=0.05, retry_after=0) as fake:
+        return recommend(fake, 200, 20)
+
+
+SCENARIOS = {
+    "crawl": crawl_scenario,
+    "flaky-crawl": flaky_crawl_scenario,
+    "queue-crawl": queue_crawl_scenario,
+    "search-burst": search_burst_scenario,
+    "scale": scale_scenario,
+    "recommend": recommend_scenario,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run load-test scenarios against a local fake AO3.")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--works", type=int, default=10000, help="works per collection on the fake archive")
+    parser.add_argument("--latency", default="lognormal:50,0.5", help="response latency spec (see fake_ao3.py)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        # Keep the crawler's progress messages out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            results.append({"scenario": name, **SCENARIOS[name](args)})
+    json.dump({"benchmark": "load", "latency": args.latency, "results": results}, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,135 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import bench_startup
+import bookmarks
+from fixture_server import FixtureServer, load_fixture
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(fn, repeat):
+    """Median wall-clock seconds of `repeat` calls to fn, and its last result."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def bench_parse(repeat):
+    """Seconds per page and per blurb to parse each fixture page."""
+    from bs4 import BeautifulSoup
+    results = {}
+    for name, parse in [("collection_works.html", bookmarks.parse_collection_blurbs),
+                        ("search_results.html", bookmarks.parse_search_blurbs)]:
+        html = load_fixture(name)
+        seconds, works = timed(lambda: parse(BeautifulSoup(html, "html.parser")), repeat)
+        results[name] = {"seconds_per_page": seconds, "blurbs": len(works),
+                         "seconds_per_blurb": seconds / len(works) if works else None}
+    html = load_fixture("work.html")
+    seconds, _ = timed(lambda: bookmarks.parse_work_page(BeautifulSoup(html, "html.parser"), "work"), repeat)
+    results["work.html"] = {"seconds_per_page": seconds}
+    return results
+
+
+def bench_crawl(base_url, pages, repeat):
+    """Pages per second crawling a collection from the local fixture server."""
+    seconds, works = timed(lambda: list(bookmarks.get_collection_works("bench", base_url=base_url)), repeat)
+    return {"pages": pages, "works": len(works), "seconds": seconds, "pages_per_second": pages / seconds}
+
+
+def synthetic_corpus(n_works, seed=42):
+    """n_works works whose tags and summaries are resampled from the fixture blurbs."""
+    from bs4 import BeautifulSoup
+    blurbs = bookmarks.parse_search_blurbs(BeautifulSoup(load_fixture("search_results.html"), "html.parser"))
+    blurbs += bookmarks.parse_search_blurbs(BeautifulSoup(load_fixture("collection_works.html"), "html.parser"))
+    all_tags = sorted({tag for work in blurbs for tag in work["tags"]})
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n_works):
+        base = rng.choice(blurbs)
+        corpus.append({**base, "link": f"https://archiveofourown.org/works/{i}",
+                       "tags": rng.sample(all_tags, min(len(all_tags), rng.randint(4, 12)))})
+    return corpus
+
+
+def bench_fit(corpus_sizes, n_topics, repeat):
+    """TF-IDF vectorize and LDA fit time for each corpus size."""
+    from sklearn.decomposition import LatentDirichletAllocation
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    results = []
+    for n_works in corpus_sizes:
+        tag_docs = [", ".join(work["tags"]) for work in synthetic_corpus(n_works)]
+        vectorize_seconds, matrix = timed(
+            lambda: TfidfVectorizer(tokenizer=bookmarks.split_tags, token_pattern=None).fit_transform(tag_docs),
+            repeat)
+        lda_seconds, _ = timed(
+            lambda: LatentDirichletAllocation(n_components=n_topics, random_state=42).fit(matrix), repeat)
+        results.append({"works": n_works, "vocabulary": matrix.shape[1],
+                        "vectorize_seconds": vectorize_seconds, "lda_fit_seconds": lda_seconds})
+    return results
+
+
+def bench_recommend(base_url, n_works, n_topics, repeat):
+    """End-to-end recommendation latency against the local fixture server, with the search cache off."""
+    works = synthetic_corpus(n_works, seed=7)
+    bookmarks.SEARCH_CACHE.enabled = False
+    seconds, recommendations = timed(
+        lambda: bookmarks.recommend_works_by_tags(works, n_topics=n_topics, n_recommendations=10, base_url=base_url),
+        repeat)
+    return {"works": n_works, "n_topics": n_topics, "recommendations": len(recommendations), "seconds": seconds}
+
+
+def run(repeat=3, pages=5, corpus_sizes=(100, 1000, 5000), n_topics=20, startup=True):
+    results = {
+        "benchmark": "suite",
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "parse": bench_parse(repeat),
+    }
+    # Keep the crawler's progress messages out of the JSON on stdout
+    with FixtureServer(pages=pages) as server, contextlib.redirect_stdout(sys.stderr):
+        results["crawl"] = bench_crawl(server.base_url, pages, repeat)
+        results["fit"] = bench_fit(corpus_sizes, n_topics, repeat)
+        results["recommend"] = bench_recommend(server.base_url, corpus_sizes[0], n_topics, repeat)
+    if startup:
+        results["startup"] = bench_startup.run(repeat)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite against synthetic AO3-style pages.")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (the median is reported)")
+    parser.add_argument("--pages", type=int, default=5, help="pages per listing served by the fixture server")
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="corpus sizes to time vectorizing and LDA fitting on")
+    parser.add_argument("--n-topics", type=int, default=20)
+    parser.add_argument("--no-startup", action="store_true", help="skip the startup benchmark")
+    parser.add_argument("-o", "--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+    results = run(args.repeat, args.pages, args.corpus_sizes, args.n_topics, not args.no_startup)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,114 +1,328 @@
-import requests
-from bs4 import BeautifulSoup
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
-import numpy as np
-from urllib.parse import quote_plus
-from sklearn.feature_extraction.text import TfidfVectorizer
-
-def get_collection_works(collection_name):
-    """Yield info dicts for each work in the given AO3 collection."""
-    base_url = f"https://archiveofourown.gay/collections/{collection_name}/works"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; AO3Scraper/1.0)"
-    }
-    proxies = {
-        "http": None,
-        "https": None
+import argparse
+import contextlib
+import csv
+import heapq
+import itertools
+import json
+import logging
+import os
+import pickle
+import queue
+import re
+import socket
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, quote_plus, unquote, urlsplit
+from cache import TTLCache
+from crawl_queue import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, CrawlQueue
+from seen_works import SeenWorks, work_id
+from metrics import METRICS
+import profiling
+
+# requests, BeautifulSoup, numpy, scipy and scikit-learn are slow to import, so they are imported
+# inside the functions that need them: prompts, --help and cache hits start without paying for them.
+
+# Where pages are fetched from. The .gay mirror mitigates 503 errors and timeouts; work links
+# in results always use the canonical archiveofourown.org address.
+AO3_BASE_URL = os.environ.get("AO3_BASE_URL", "https://archiveofourown.gay")
+
+# Retries per fetch on 429/5xx responses, and the exponential backoff factor in seconds between them
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.5
+
+REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; AO3Scraper/1.0)"
+}
+REQUEST_PROXIES = {
+    "http": None,
+    "https": None
+}
+
+log = logging.getLogger("bookmarks")
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the shared requests session (created on first use) so fetches reuse pooled keep-alive connections."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from urllib3.util.retry import Retry
+                # Back off and retry when AO3 is rate limiting (429) or overloaded (5xx),
+                # honouring its Retry-After header
+                retry = Retry(total=FETCH_RETRIES, backoff_factor=FETCH_BACKOFF, status_forcelist=(429, 502, 503, 504),
+                              allowed_methods=("GET",), respect_retry_after_header=True, raise_on_status=False)
+                session = requests.Session()
+                for prefix in ("https://", "http://"):
+                    session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32,
+                                                                        max_retries=retry))
+                _session = session
+    return _session
+
+def http_get(url, **kwargs):
+    """
+    GET url with the shared session, recording requests, bytes received and latency per host.
+    With stream=True the body is left unread, and the caller counts the bytes it reads.
+    """
+    host = urlsplit(url).netloc
+    log.debug("Fetching: %s", url)
+    try:
+        with METRICS.timer("http_request_seconds", host=host):
+            response = get_session().get(url, headers=REQUEST_HEADERS, proxies=REQUEST_PROXIES, **kwargs)
+    except Exception:
+        METRICS.inc("http_requests_total", host=host, status="error")
+        raise
+    METRICS.inc("http_requests_total", host=host, status=response.status_code)
+    if not kwargs.get("stream"):
+        METRICS.inc("http_response_bytes_total", len(response.content), host=host)
+    return response
+
+def parse_stat(stats_tag):
+    """Return the integer in a dl.stats <dd> tag (e.g. "1,234"), or 0 if it is missing or not a number."""
+    try:
+        return int(stats_tag.get_text(strip=True).replace(',', '')) if stats_tag else 0
+    except Exception:
+        return 0
+
+def parse_work_blurb(work, all_tags=False):
+    """
+    Return the info dict for one li.work.blurb.group element, or None if it has no work link.
+    Only "Additional Tags" (freeforms) are kept unless all_tags is set.
+    """
+    # Extract link
+    link_tag = work.select_one("div.header > h4 > a")
+    if not link_tag:
+        return None
+    href = link_tag.get("href")
+    if not href:
+        return None
+    full_link = f"https://archiveofourown.org{href}"
+
+    # Title
+    title = link_tag.get_text(strip=True)
+
+    # Author
+    author_tag = work.select_one("a[rel=author]")
+    author = author_tag.get_text(strip=True) if author_tag else "Anonymous"
+
+    if all_tags:
+        tags = [tag.get_text(strip=True) for tag in work.select("ul.tags.commas > li")]
+    else:
+        # Only include tags under "Additional Tags"
+        tags = []
+        for li in work.select("ul.tags.commas > li.freeforms"):
+            tags.extend([tag.get_text(strip=True) for tag in li.select("a.tag")])
+
+    # Fandom
+    fandom_tag = work.select_one("h5.fandoms > a")
+    fandom = fandom_tag.get_text(strip=True) if fandom_tag else ""
+
+    # Summary
+    summary_tag = work.select_one("blockquote.userstuff.summary")
+    summary = summary_tag.get_text(strip=True) if summary_tag else ""
+
+    # Hits, Kudos and Bookmarks
+    return {
+        "link": full_link,
+        "title": title,
+        "author": author,
+        "tags": tags,
+        "fandom": fandom,
+        "summary": summary,
+        "hits": parse_stat(work.select_one("dl.stats > dd.hits")),
+        "kudos": parse_stat(work.select_one("dl.stats > dd.kudos")),
+        "bookmarks": parse_stat(work.select_one("dl.stats > dd.bookmarks"))
     }
+
+def parse_collection_blurbs(soup):
+    """Return an info dict (with only "Additional Tags") for each work blurb on a listing page."""
+    works = [parse_work_blurb(work) for work in soup.select("li.work.blurb.group")]
+    return [work for work in works if work is not None]
+
+def get_collection_works(collection_name, max_pages=None, base_url=None):
+    """
+    Yield info dicts for each work in the given AO3 collection, reading at most max_pages listing pages if given.
+    Pages are fetched from base_url (default AO3_BASE_URL).
+    """
+    from bs4 import BeautifulSoup
+    base_url = f"{base_url or AO3_BASE_URL}/collections/{collection_name}/works"
     page = 1
 
     while True:
         url = base_url
         if page > 1:
             url = f"{base_url}?page={page}"
-        print(f"Fetching: {url}")
-        response = requests.get(url, headers=headers, proxies=proxies, verify=False)
+        with profiling.stage("crawl"):
+            response = http_get(url, verify=False)
         if response.status_code != 200:
-            print(f"Failed to fetch page {page}: Status {response.status_code}")
+            log.warning("Failed to fetch page %d: Status %d", page, response.status_code)
             break
 
-        soup = BeautifulSoup(response.content, "html.parser")
-        works = soup.select("li.work.blurb.group")
+        with METRICS.timer("parse_seconds", page="collection"), profiling.stage("parse"):
+            soup = BeautifulSoup(response.content, "html.parser")
+            works = parse_collection_blurbs(soup)
+        METRICS.inc("blurbs_parsed_total", len(works), page="collection")
         if not works:
             break
+        yield from works
 
-        for work in works:
-            # Extract link
-            link_tag = work.select_one("div.header > h4 > a")
-            if not link_tag:
-                continue
-            href = link_tag.get("href")
-            if not href:
-                continue
-            full_link = f"https://archiveofourown.org{href}"
-
-            # Title
-            title = link_tag.get_text(strip=True)
+        next_page = soup.select_one("li.next > a")
+        if not next_page or (max_pages is not None and page >= max_pages):
+            break
+        page += 1
 
-            # Author
-            author_tag = work.select_one("a[rel=author]")
-            author = author_tag.get_text(strip=True) if author_tag else "Anonymous"
+def page_count(soup):
+    """The last page number in a listing's pagination list (1 if it has none)."""
+    numbers = [item.get_text(strip=True) for item in soup.select("ol.pagination li > a, ol.pagination li > span")]
+    return max((int(number) for number in numbers if number.isdigit()), default=1)
 
-            # Only include tags under "Additional Tags"
-            additional_tags = []
-            additional_tags_li = work.select("ul.tags.commas > li.freeforms")
-            for li in additional_tags_li:
-                additional_tags.extend([tag.get_text(strip=True) for tag in li.select("a.tag")])
+def parse_bookmark_blurbs(soup):
+    """
+    Return an info dict (with only "Additional Tags") for each bookmarked work on a bookmarks page,
+    plus the bookmarker's own "bookmark_tags", "bookmark_notes" and whether they marked it a "rec".
+    Bookmarks of series and external works are skipped.
+    """
+    works = []
+    for blurb in soup.select("li.bookmark.blurb.group"):
+        work = parse_work_blurb(blurb)
+        if work is None or not work["link"].startswith("https://archiveofourown.org/works/"):
+            continue
+        user = blurb.select_one("div.user")
+        notes = user.select_one("blockquote.userstuff.notes") if user else None
+        work["bookmark_tags"] = [tag.get_text(strip=True) for tag in user.select("ul.meta.tags a.tag")] if user else []
+        work["bookmark_notes"] = notes.get_text(" ", strip=True) if notes else ""
+        work["rec"] = user is not None and user.select_one("span.rec") is not None
+        works.append(work)
+    return works
 
-            # Fandom
-            fandom_tag = work.select_one("h5.fandoms > a")
-            fandom = fandom_tag.get_text(strip=True) if fandom_tag else ""
+def get_user_bookmarks(username, max_pages=None, max_workers=8, base_url=None):
+    """
+    Yield info dicts (see parse_bookmark_blurbs) for the works an AO3 user has bookmarked, newest first.
+    The first page tells how many pages there are; the rest (at most max_pages in all) are then
+    fetched max_workers at a time and yielded in page order. Pages are fetched from base_url
+    (default AO3_BASE_URL).
+    """
+    from bs4 import BeautifulSoup
+    url = f"{base_url or AO3_BASE_URL}/users/{quote(username)}/bookmarks"
 
-            # Summary
-            summary_tag = work.select_one("blockquote.userstuff.summary")
-            summary = summary_tag.get_text(strip=True) if summary_tag else ""
+    def fetch(page):
+        with profiling.stage("crawl"):
+            response = http_get(f"{url}?page={page}" if page > 1 else url, verify=False)
+        if response.status_code != 200:
+            log.warning("Failed to fetch bookmarks page %d of %s: Status %d", page, username, response.status_code)
+            return 0, []
+        with METRICS.timer("parse_seconds", page="bookmarks"), profiling.stage("parse"):
+            soup = BeautifulSoup(response.content, "html.parser")
+            works = parse_bookmark_blurbs(soup)
+            n_pages = page_count(soup)
+        METRICS.inc("blurbs_parsed_total", len(works), page="bookmarks")
+        return n_pages, works
 
-            # Hits and Kudos
-            hits_tag = work.select_one("dl.stats > dd.hits")
-            kudos_tag = work.select_one("dl.stats > dd.kudos")
-            try:
-                hits = int(hits_tag.get_text(strip=True).replace(',', '')) if hits_tag else 0
-            except Exception:
-                hits = 0
-            try:
-                kudos = int(kudos_tag.get_text(strip=True).replace(',', '')) if kudos_tag else 0
-            except Exception:
-                kudos = 0
-
-            yield {
-                "link": full_link,
-                "title": title,
-                "author": author,
-                "tags": additional_tags,
-                "fandom": fandom,
-                "summary": summary,
-                "hits": hits,
-                "kudos": kudos
-            }
+    n_pages, works = fetch(1)
+    yield from works
+    if max_pages is not None:
+        n_pages = min(n_pages, max_pages)
+    if n_pages <= 1:
+        return
+    executor = ThreadPoolExecutor(max_workers=max(min(max_workers, n_pages - 1), 1))
+    try:
+        for _, works in executor.map(fetch, range(2, n_pages + 1)):
+            yield from works
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-        next_page = soup.select_one("li.next > a")
-        if not next_page:
-            break
-        page += 1
+def fetch_url(url, base_url=None):
+    """
+    Rebuild an archiveofourown.org link (with any scheme, or none) on base_url (default
+    AO3_BASE_URL), keeping its path and query. Links to other hosts are returned unchanged.
+    """
+    url = url.strip()
+    if "://" not in url and not url.startswith("/"):
+        # "archiveofourown.org/works/123" has no scheme, so urlsplit would read the host as a path
+        url = "//" + url
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host and host != "archiveofourown.org" and not host.endswith(".archiveofourown.org"):
+        return url.lstrip("/") if url.startswith("//") else url
+    return f"{base_url or AO3_BASE_URL}{parts.path}" + (f"?{parts.query}" if parts.query else "")
 
-def extract_work_info(work_url):
-    # Change the URL ending to .gay in order to mitigate 503 errors and timeouts.
-    work_url = work_url.replace("archiveofourown.org", "archiveofourown.gay")
-    """Extract and return info for a single work given its URL."""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; AO3Scraper/1.0)"
-    }
-    proxies = {
-        "http": None,
-        "https": None
-    }
-    response = requests.get(work_url, headers=headers, proxies=proxies)
+def extract_work_info(work_url, base_url=None):
+    """
+    Extract and return info for a single work given its URL, fetched from base_url (default AO3_BASE_URL).
+    The returned "link" is the canonical archiveofourown.org address, as in search and listing results.
+    """
+    from bs4 import BeautifulSoup
+    work_id_ = work_id(work_url)
+    link = f"https://archiveofourown.org/works/{work_id_}" if work_id_ is not None else work_url
+    # Fetch from the .gay mirror (AO3_BASE_URL) in order to mitigate 503 errors and timeouts.
+    url = fetch_url(work_url, base_url)
+    response = http_get(url)
     if response.status_code != 200:
-        print(f"Failed to fetch work: {work_url}")
+        log.warning("Failed to fetch work: %s", url)
         return None
 
-    soup = BeautifulSoup(response.content, "html.parser")
+    with METRICS.timer("parse_seconds", page="work"), profiling.stage("parse"):
+        return parse_work_page(BeautifulSoup(response.content, "html.parser"), link)
+
+def download_work_text(work_url, store, base_url=None, chunk_size=64 * 1024):
+    """
+    Stream the full text of a work (all chapters, via view_full_work=true) from base_url into
+    `store`, a text_store.TextStore. The page is parsed as it arrives, chunk_size bytes at a time,
+    and each chapter is compressed straight to disk, so a work is never held in memory whole.
+    Returns the number of chapters stored, or None if the page could not be fetched or had no text.
+    """
+    import codecs
+    from text_store import ChapterTextParser
+    work_id_ = work_id(work_url)
+    url = f"{base_url or AO3_BASE_URL}/works/{work_id_}?view_full_work=true&view_adult=true"
+    host = urlsplit(url).netloc
+    with profiling.stage("crawl"):
+        response = http_get(url, verify=False, stream=True)
+    with response:
+        if response.status_code != 200:
+            log.warning("Failed to fetch the text of %s: Status %d", work_url, response.status_code)
+            return None
+        # AO3 serves UTF-8; decoding incrementally keeps multi-byte characters split across chunks intact
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with store.writer(work_id_) as writer:
+            parser = ChapterTextParser(writer)
+            for chunk in response.iter_content(chunk_size):
+                METRICS.inc("http_response_bytes_total", len(chunk), host=host)
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+    if not writer.chapters:
+        log.warning("No chapter text found for %s", work_url)
+        return None
+    METRICS.inc("work_texts_downloaded_total")
+    return len(writer.chapters)
+
+def download_work_texts(work_urls, store, max_workers=4, base_url=None, skip_existing=True):
+    """
+    Download the full texts of work_urls into store, max_workers at a time, yielding
+    (work_url, chapters stored or None) in input order. Works already in the store are skipped
+    (yielding their stored chapter count) unless skip_existing is False.
+    """
+    def download(work_url):
+        work_id_ = work_id(work_url)
+        if work_id_ is None:
+            log.warning("Not a work URL: %s", work_url)
+            return None
+        if skip_existing and work_id_ in store:
+            return len(store.chapters(work_id_))
+        return download_work_text(work_url, store, base_url)
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        yield from zip(work_urls, executor.map(download, work_urls))
+
+def parse_work_page(soup, work_url):
+    """Return the info dict for a parsed work page."""
     # Title
     title_tag = soup.select_one("h2.title.heading")
     title = title_tag.get_text(strip=True) if title_tag else ""
@@ -128,18 +342,7 @@ def extract_work_info(work_url):
     summary_tag = soup.select_one("div.summary blockquote.userstuff")
     summary = summary_tag.get_text(strip=True) if summary_tag else ""
 
-    # Hits and Kudos
-    hits_tag = soup.select_one("dl.stats > dd.hits")
-    kudos_tag = soup.select_one("dl.stats > dd.kudos")
-    try:
-        hits = int(hits_tag.get_text(strip=True).replace(',', '')) if hits_tag else 0
-    except Exception:
-        hits = 0
-    try:
-        kudos = int(kudos_tag.get_text(strip=True).replace(',', '')) if kudos_tag else 0
-    except Exception:
-        kudos = 0
-
+    # Hits, Kudos and Bookmarks
     return {
         "link": work_url,
         "title": title,
@@ -147,174 +350,1481 @@ def extract_work_info(work_url):
         "tags": tags,
         "fandom": fandom,
         "summary": summary,
-        "hits": hits,
-        "kudos": kudos
+        "hits": parse_stat(soup.select_one("dl.stats > dd.hits")),
+        "kudos": parse_stat(soup.select_one("dl.stats > dd.kudos")),
+        "bookmarks": parse_stat(soup.select_one("dl.stats > dd.bookmarks"))
     }
 
-def print_works(works_data):
-    # Sort by kudos, then hits (descending)
-    works_data.sort(key=lambda x: (x["kudos"], x["hits"]), reverse=True)
-    print(f"\nFound {len(works_data)} works:\n")
-    for work in works_data:
-        print(work["link"])
-        print(f"Title: {work['title']}")
-        print(f"Author: {work['author']}")
-        print(f"Fandom: {work['fandom']}")
-        print(f"Summary: {work['summary']}")
-        print(f"Tags: {', '.join(work['tags'])}")
-        print(f"Hits: {work['hits']}, Kudos: {work['kudos']}")
-        print("-" * 40)
-        print()
-
-def recommend_works_by_tags(works_data, n_topics=150, n_recommendations=5):
+# Bayesian prior strength for the "engagement" score, in hits: works with far fewer hits than
+# this are pulled towards the collection-wide engagement rate
+ENGAGEMENT_PRIOR_HITS = 500
+
+def popularity_arrays(works):
+    """Return (kudos, hits, bookmarks) of works as float arrays."""
+    import numpy as np
+    n = len(works)
+    kudos = np.fromiter((work["kudos"] for work in works), dtype=np.float64, count=n)
+    hits = np.fromiter((work["hits"] for work in works), dtype=np.float64, count=n)
+    bookmarks = np.fromiter((work.get("bookmarks", 0) for work in works), dtype=np.float64, count=n)
+    return kudos, hits, bookmarks
+
+def _rate(numerator, hits):
+    import numpy as np
+    return np.divide(numerator, hits, out=np.zeros_like(numerator), where=hits > 0)
+
+def engagement_score(kudos, hits, bookmarks, prior_hits=ENGAGEMENT_PRIOR_HITS):
     """
-    Recommend new AO3 works based on tag similarity using TF-IDF and LDA.
-    Only recommends works not already in works_data.
-    If not enough recommendations are found, iteratively remove the lowest-weighted tag and search again.
+    Bayesian-smoothed engagement rate: (kudos + 2 * bookmarks) per hit, shrunk towards the
+    rate of the whole set so that a handful of hits can't produce an extreme score.
+    """
+    engagement = kudos + 2 * bookmarks
+    total_hits = hits.sum()
+    prior_rate = engagement.sum() / total_hits if total_hits > 0 else 0.0
+    return (engagement + prior_hits * prior_rate) / (hits + prior_hits)
+
+POPULARITY_SCORERS = {
+    "kudos": lambda kudos, hits, bookmarks: kudos,
+    "kudos_ratio": lambda kudos, hits, bookmarks: _rate(kudos, hits),
+    "bookmark_rate": lambda kudos, hits, bookmarks: _rate(bookmarks, hits),
+    "engagement": engagement_score,
+}
+
+def rank_works(works, scoring="kudos", top=None):
+    """
+    Return the indices of works ordered by the chosen popularity score (descending), breaking
+    ties by kudos and then hits. With `top`, only the best `top` works are selected
+    (argpartition) before sorting, so ranking large collections stays cheap.
+    """
+    import numpy as np
+    if not works:
+        return np.empty(0, dtype=np.intp)
+    kudos, hits, bookmarks = popularity_arrays(works)
+    scores = POPULARITY_SCORERS[scoring](kudos, hits, bookmarks)
+
+    candidates = np.arange(len(works))
+    if top is not None and top < len(works):
+        # Keep everything tied with the top-th score so the tie-breaks below still apply
+        threshold = -np.partition(-scores, top - 1)[top - 1]
+        candidates = np.flatnonzero(scores >= threshold)
+    # np.lexsort sorts ascending by the last key first; negate for descending order
+    order = np.lexsort((-hits[candidates], -kudos[candidates], -scores[candidates]))
+    return candidates[order][:top]
+
+def _rate_key(numerator_field):
+    def key(work):
+        rate = work.get(numerator_field, 0) / work["hits"] if work["hits"] > 0 else 0.0
+        return (rate, work["kudos"], work["hits"])
+    return key
+
+# Per-work sort keys matching rank_works, for scorings that need no collection-wide statistics.
+# These let top-k selection run over a stream of works without materializing it.
+STREAMING_SORT_KEYS = {
+    "kudos": lambda work: (work["kudos"], work["hits"]),
+    "kudos_ratio": _rate_key("kudos"),
+    "bookmark_rate": _rate_key("bookmarks"),
+}
+
+def top_works(works, scoring="kudos", top=None):
+    """
+    Return works (a list or any iterable) ordered by the chosen scoring, limited to `top` if given.
+    Never reorders the caller's list. An iterable is consumed with heapq.nlargest, holding only
+    `top` works at a time, when the scoring allows it.
+    """
+    if not isinstance(works, list):
+        if top is not None and scoring in STREAMING_SORT_KEYS:
+            return heapq.nlargest(top, works, key=STREAMING_SORT_KEYS[scoring])
+        works = list(works)
+    return [works[i] for i in rank_works(works, scoring, top)]
+
+def format_work(work):
+    """Render the text summary of one work."""
+    return (
+        f"{work['link']}\n"
+        f"Title: {work['title']}\n"
+        f"Author: {work['author']}\n"
+        f"Fandom: {work['fandom']}\n"
+        f"Summary: {work['summary']}\n"
+        f"Tags: {', '.join(work['tags'])}\n"
+        f"Hits: {work['hits']}, Kudos: {work['kudos']}, Bookmarks: {work.get('bookmarks', 0)}\n"
+        f"{'-' * 40}\n"
+        "\n"
+    )
+
+def print_works(works_data, scoring="kudos", top=None, out=None):
+    """
+    Print a summary of each work, most popular first by the chosen scoring (see POPULARITY_SCORERS),
+    limited to the `top` most popular if given. The whole listing is rendered and written at once.
+    """
+    out = out or sys.stdout
+    works = top_works(works_data, scoring, top)
+    found = len(works_data) if isinstance(works_data, list) else len(works)
+    header = f"\nFound {found} works:\n\n"
+    if top is not None and len(works) < found:
+        header = f"\nFound {found} works, showing the top {len(works)}:\n\n"
+    out.write(header + "".join(format_work(work) for work in works))
+    out.flush()
+
+EXPORT_FIELDS = ["link", "title", "author", "fandom", "summary", "tags", "hits", "kudos", "bookmarks"]
+# Which reader, rank or collection a record belongs to; written first when the records carry them
+CONTEXT_FIELDS = ["reader", "rank", "collection"]
+
+def write_ndjson(works, out):
+    """Stream works to `out` as newline-delimited JSON, one record per work as it is produced."""
+    count = 0
+    for work in works:
+        out.write(json.dumps(work, ensure_ascii=False) + "\n")
+        count += 1
+    out.flush()
+    return count
+
+def write_csv(works, out, context_fields=None):
+    """
+    Stream works to `out` as CSV (tags joined with commas), one row per work as it is produced.
+    The CONTEXT_FIELDS in context_fields (default: those the first work has) lead each row.
+    """
+    works = iter(works)
+    first = next(works, None)
+    if context_fields is None:
+        context_fields = [field for field in CONTEXT_FIELDS if first is not None and field in first]
+    writer = csv.DictWriter(out, fieldnames=list(context_fields) + EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for work in itertools.chain([first] if first is not None else [], works):
+        writer.writerow({**work, "tags": ", ".join(work.get("tags", []))})
+        count += 1
+    out.flush()
+    return count
+
+EXPORTERS = {"ndjson": write_ndjson, "csv": write_csv}
+
+def split_tags(tag_doc):
+    """Tokenizer for comma-joined tag documents (each tag is one token)."""
+    return [tag.strip() for tag in tag_doc.split(",") if tag.strip()]
+
+CACHE_DIR = os.environ.get("AO3_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ao3_recommender"))
+
+SEARCH_CACHE = TTLCache(
+    ttl=15 * 60,  # kudos and hit counts drift, so keep search results only briefly
+    max_entries=512,
+    directory=os.path.join(CACHE_DIR, "search"),
+    max_disk_entries=20000,
+)
+METRICS.gauge("search_cache_hits", lambda: SEARCH_CACHE.hits)
+METRICS.gauge("search_cache_misses", lambda: SEARCH_CACHE.misses)
+METRICS.gauge("search_cache_hit_ratio",
+              lambda: SEARCH_CACHE.hits / max(SEARCH_CACHE.hits + SEARCH_CACHE.misses, 1))
+TAG_CACHE = TTLCache(
+    ttl=7 * 24 * 3600,  # wrangling changes rarely, so a tag's page is fetched at most weekly
+    max_entries=20000,
+    directory=os.path.join(CACHE_DIR, "tags"),
+    max_disk_entries=200000,
+)
+METRICS.gauge("tag_cache_hits", lambda: TAG_CACHE.hits)
+METRICS.gauge("tag_cache_misses", lambda: TAG_CACHE.misses)
+# Tag searches (every rung of every relaxation ladder) started per recommendation
+METRICS.set_buckets("search_queries_per_recommendation", (1, 2, 5, 10, 15, 20, 30, 50, 100))
+
+def build_search_url(tags, sort_column="kudos_count", sort_direction="desc", filters=None, page=1, base_url=None):
+    """
+    Return the AO3 works search URL (for the given results page) for works carrying all of the given freeform tags.
+    filters maps other work_search fields (e.g. "complete", "language_id") to values.
+    """
+    fields = {
+        "query": "",
+        "title": "",
+        "creators": "",
+        "revised_at": "",
+        "complete": "",
+        "crossover": "",
+        "single_chapter": "0",
+        "word_count": "",
+        "language_id": "",
+        "fandom_names": "",
+        "rating_ids": "",
+        "character_names": "",
+        "relationship_names": "",
+        "freeform_names": ", ".join(tags),
+        "hits": "",
+        "kudos_count": "",
+        "comments_count": "",
+        "bookmarks_count": "",
+        "sort_column": sort_column,
+        "sort_direction": sort_direction,
+    }
+    fields.update(filters or {})
+    query = "&".join(f"work_search%5B{name}%5D={quote_plus(str(value))}" for name, value in fields.items())
+    if page > 1:
+        query += f"&page={page}"
+    return f"{base_url or AO3_BASE_URL}/works/search?{query}&commit=Search"
+
+def search_cache_key(tags, sort_column="kudos_count", sort_direction="desc", filters=None, page=1, base_url=None):
+    """Cache key for a search page: AO3 matches tags as a set, so their order and repeats don't matter."""
+    return json.dumps({
+        "host": base_url or AO3_BASE_URL,
+        "tags": sorted(set(tag.strip() for tag in tags)),
+        "sort_column": sort_column,
+        "sort_direction": sort_direction,
+        "filters": sorted((filters or {}).items()),
+        "page": page,
+    })
+
+def parse_search_blurbs(soup):
+    """Return an info dict (with every tag) for each work blurb on a search results or works listing page."""
+    works = [parse_work_blurb(work, all_tags=True) for work in soup.select("li.work.blurb.group")]
+    return [work for work in works if work is not None]
+
+def fetch_search_page(search_tags, sort_column="kudos_count", sort_direction="desc", filters=None, page=1,
+                      cache=SEARCH_CACHE, cancelled=None, base_url=None):
+    """
+    Return (works, has_next_page) for one page of an AO3 search on base_url (default AO3_BASE_URL),
+    or None if the search failed.
+    Results are served from `cache` (keyed by the normalized query and page) while they are fresh;
+    pass cache=None to always fetch. Returns ([], False) without fetching once `cancelled` is set.
+    """
+    from bs4 import BeautifulSoup
+    if cancelled is not None and cancelled.is_set():
+        return [], False
+    key = search_cache_key(search_tags, sort_column, sort_direction, filters, page, base_url)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            log.debug("Using cached search results for tags: %s (page %d)", ", ".join(search_tags), page)
+            return cached["works"], cached["has_next"]
+
+    search_url = build_search_url(search_tags, sort_column, sort_direction, filters, page, base_url)
+    with profiling.stage("search"):
+        response = http_get(search_url, verify=False)
+    if response.status_code != 200:
+        log.warning("Failed to fetch search results: Status %d", response.status_code)
+        return None
+    if cancelled is not None and cancelled.is_set():
+        return [], False
+
+    with METRICS.timer("parse_seconds", page="search"), profiling.stage("parse"):
+        soup = BeautifulSoup(response.content, "html.parser")
+        works = parse_search_blurbs(soup)
+        has_next = soup.select_one("li.next > a") is not None
+    METRICS.inc("blurbs_parsed_total", len(works), page="search")
+    if cache is not None:
+        cache.set(key, {"works": works, "has_next": has_next})
+    return works, has_next
+
+def iter_search_pages(search_tags, max_pages=3, cancelled=None, first_page=1, **search_options):
+    """
+    Lazily yield the works on each page of an AO3 search from first_page, up to page max_pages.
+    The next page is fetched in the background while the caller processes the current one.
+    Stops early when the results run out, a page fails to load, or `cancelled` is set.
+    """
+    prefetcher = ThreadPoolExecutor(max_workers=1)
+    next_page = None
+    try:
+        next_page = prefetcher.submit(fetch_search_page, search_tags, page=first_page, cancelled=cancelled,
+                                      **search_options)
+        for page in range(first_page, max_pages + 1):
+            result = next_page.result()
+            if result is None:
+                return
+            works, has_next = result
+            next_page = None
+            if has_next and page < max_pages and not (cancelled is not None and cancelled.is_set()):
+                next_page = prefetcher.submit(fetch_search_page, search_tags, page=page + 1,
+                                              cancelled=cancelled, **search_options)
+            yield works
+            if next_page is None:
+                return
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+        prefetcher.shutdown(wait=False)
+
+def fetch_search_results(search_tags, existing_links, n_recommendations=5, cancelled=None, max_pages=3,
+                         base_url=None, seen=None, first_page=1):
+    """
+    Search AO3 (base_url, default AO3_BASE_URL) for works tagged with all of search_tags and return up to
+    n_recommendations works that are not in existing_links or `seen` (a SeenWorks), paging through
+    result pages first_page to max_pages.
+    Returns None if the first page could not be fetched, and returns early once `cancelled` is set.
+    """
+    if cancelled is not None and cancelled.is_set():
+        return []
+    log.debug("Searching AO3 for new works with tags: %s", ", ".join(search_tags))
+
+    recommendations = []
+    seen_links = set(existing_links)
+    pages_read = 0
+    for works in iter_search_pages(search_tags, max_pages=max_pages, cancelled=cancelled, first_page=first_page,
+                                   base_url=base_url):
+        pages_read += 1
+        for work in works:
+            if work["link"] in seen_links or (seen is not None and seen.seen_link(work["link"])):
+                continue  # Skip already known or already recommended works
+            seen_links.add(work["link"])
+            recommendations.append(work)
+            if len(recommendations) >= n_recommendations:
+                return recommendations
+        if cancelled is not None and cancelled.is_set():
+            break
+
+    if pages_read == 0:
+        return None
+    return recommendations
+
+def query_rungs(tags, cooccurrence=None):
+    """
+    The searches of a query's tag-relaxation ladder, most specific first: the full tag list, then
+    with the lowest-weighted tag removed, and so on. With a TagCooccurrence matrix, each removal is
+    preceded by a search replacing the removed tag with its closest related tag (by PMI) that still
+    co-occurs with the kept tags, so a short result list is widened before the query is loosened.
+    """
+    tags = list(tags)
+    if not tags:
+        return []
+    rungs = [tags]
+    for keep in range(len(tags) - 1, 0, -1):
+        kept = tags[:keep]
+        if cooccurrence is not None:
+            substitute = cooccurrence.substitute(kept, tags[keep], exclude=tags)
+            if substitute is not None:
+                rungs.append(kept + [substitute])
+        rungs.append(kept)
+    return rungs
+
+def load_cooccurrence(cooccurrence):
+    """A TagCooccurrence from a directory saved by it (or None, or an already loaded one)."""
+    if isinstance(cooccurrence, str):
+        from tag_cooccurrence import TagCooccurrence
+        return TagCooccurrence.load(cooccurrence)
+    return cooccurrence
+
+# Searches (and author pages) in flight at once for one recommendation call, unless max_workers says otherwise
+SEARCH_CONCURRENCY = 4
+
+def start_search_ladders(executor, queries, existing_links, n_recommendations=5, max_pages=3, rungs=None,
+                         seen=None, base_url=None):
+    """
+    Speculatively submit the first result page of every rung of each query's tag-relaxation ladder
+    (see query_rungs, or the already computed `rungs` of each query) instead of waiting for each
+    rung to fail. Only the rung collect_search_ladder is consuming reads further pages.
+    Works in existing_links or `seen` are left out of the results.
+    Rungs are submitted most-specific first across all queries, so a small pool still fetches
+    the searches most likely to be used first.
+    """
+    if rungs is None:
+        rungs = [query_rungs(tags) for tags in queries]
+    ladders = [{"rungs": ladder_rungs, "futures": [], "cancelled": threading.Event(), "existing_links": existing_links,
+                "max_pages": max_pages, "seen": seen, "base_url": base_url} for ladder_rungs in rungs]
+    longest = max((len(ladder_rungs) for ladder_rungs in rungs), default=0)
+    for position in range(longest):
+        for ladder in ladders:
+            if position < len(ladder["rungs"]):
+                ladder["futures"].append(executor.submit(fetch_search_page, ladder["rungs"][position],
+                                                         cancelled=ladder["cancelled"], base_url=base_url))
+    return ladders
+
+def collect_search_ladder(ladder, n_recommendations=5):
+    """
+    Accept results from the most specific rungs of a ladder started by start_search_ladders,
+    falling back to less specific rungs only while there are too few works. A rung whose first
+    page is not enough reads its next pages (up to the ladder's max_pages) before falling back.
+    Rungs that are no longer needed are cancelled.
+    """
+    futures, cancelled, seen = ladder["futures"], ladder["cancelled"], ladder["seen"]
+    recommendations = []
+    seen_links = set(ladder["existing_links"])
+
+    def accept(works):
+        for work in works:
+            if work["link"] not in seen_links and not (seen is not None and seen.seen_link(work["link"])):
+                seen_links.add(work["link"])
+                recommendations.append(work)
+
+    try:
+        for rung, future in enumerate(futures):
+            if rung > 0:
+                log.debug("Not enough recommendations found. Trying with fewer tags.")
+            result = future.result()
+            if result is None:
+                break
+            works, has_next = result
+            accept(works)
+            if len(recommendations) < n_recommendations and has_next and ladder["max_pages"] > 1:
+                accept(fetch_search_results(ladder["rungs"][rung], seen_links, n_recommendations - len(recommendations),
+                                            cancelled, ladder["max_pages"], ladder["base_url"], seen,
+                                            first_page=2) or [])
+            if len(recommendations) >= n_recommendations:
+                break
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+    return recommendations[:n_recommendations]
+
+def search_works_by_tags(top_tags, existing_links, n_recommendations=5, executor=None, max_pages=3, base_url=None):
+    """
+    Search AO3 (base_url, default AO3_BASE_URL) for works tagged with top_tags that are not in existing_links.
+    Every relaxation of the query (dropping the lowest-weighted tags) is searched concurrently,
+    and the most specific searches that together yield n_recommendations works are used.
+    """
+    if executor is not None:
+        return collect_search_ladder(start_search_ladders(executor, [top_tags], existing_links,
+                                                          n_recommendations, max_pages, base_url=base_url)[0],
+                                     n_recommendations)
+    executor = ThreadPoolExecutor(max_workers=max(min(len(top_tags), SEARCH_CONCURRENCY), 1))
+    try:
+        return search_works_by_tags(top_tags, existing_links, n_recommendations, executor, max_pages, base_url)
+    finally:
+        # Don't wait for searches that were still in flight when the ladder was satisfied
+        executor.shutdown(wait=False)
+
+def merge_round_robin(result_lists, weights, n_recommendations):
+    """
+    Merge ranked result lists with smooth weighted round-robin, skipping duplicate links.
+    A list with twice the weight contributes roughly twice as many of the merged results.
+    """
+    queues = [list(results) for results in result_lists]
+    current = [0.0] * len(queues)
+    merged = []
+    seen_links = set()
+    while len(merged) < n_recommendations and any(queues):
+        # Every non-empty list earns its weight; the richest one emits its next result and pays the total
+        active = [i for i, queue in enumerate(queues) if queue]
+        for i in active:
+            current[i] += weights[i]
+        pick = max(active, key=lambda i: current[i])
+        current[pick] -= sum(weights[i] for i in active)
+        work = queues[pick].pop(0)
+        if work["link"] in seen_links:
+            continue
+        seen_links.add(work["link"])
+        merged.append(work)
+    return merged
+
+# How much each signal contributes to a candidate's re-ranking score
+RERANK_WEIGHTS = {"content": 0.5, "topics": 0.3, "popularity": 0.2}
+
+# Relative weight of each block in the combined tag + summary content features
+FEATURE_WEIGHTS = {"tags": 1.0, "summary": 0.5}
+
+# Width of the hashed summary feature space; memory stays fixed however large the catalog grows
+SUMMARY_HASH_FEATURES = 2 ** 18
+
+# Hashed summary rows (indices, values) by summary text, most recently used last, so a work that
+# comes back from another search, a cached page or another reader is only hashed once per process
+SUMMARY_ROWS = OrderedDict()
+SUMMARY_ROWS_SIZE = 50000
+_summary_rows_lock = threading.Lock()
+
+def _hash_summary_chunk(summaries):
+    """Hash a chunk of summaries (runs in worker processes, so it must be module-level)."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+    vectorizer = HashingVectorizer(n_features=SUMMARY_HASH_FEATURES, alternate_sign=False,
+                                   stop_words="english", norm="l2")
+    return vectorizer.transform(summaries)
+
+def hash_summaries(works, n_jobs=1, chunk_size=2000):
     """
+    Return the (works x SUMMARY_HASH_FEATURES) hashed bag-of-words matrix of work summaries.
+    Rows of summaries hashed before are taken from SUMMARY_ROWS; the rest are hashed, and since
+    hashing needs no shared vocabulary, with n_jobs > 1 their chunks are hashed in parallel
+    worker processes.
+    """
+    import numpy as np
+    import scipy.sparse as sp
+    summaries = [work.get("summary", "") for work in works]
+    with _summary_rows_lock:
+        rows = {summary: SUMMARY_ROWS.get(summary) for summary in summaries}
+        for summary, row in rows.items():
+            if row is not None:
+                SUMMARY_ROWS.move_to_end(summary)
+    missing = [summary for summary, row in rows.items() if row is None]
+    METRICS.inc("summaries_hashed_total", len(missing))
+    chunks = [missing[start:start + chunk_size] for start in range(0, len(missing), chunk_size)]
+    if n_jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            blocks = list(executor.map(_hash_summary_chunk, chunks))
+    else:
+        blocks = [_hash_summary_chunk(chunk) for chunk in chunks]
+    if blocks:
+        hashed = sp.vstack(blocks).tocsr()
+        with _summary_rows_lock:
+            for i, summary in enumerate(missing):
+                start, end = hashed.indptr[i], hashed.indptr[i + 1]
+                row = (hashed.indices[start:end].copy(), hashed.data[start:end].copy())
+                rows[summary] = SUMMARY_ROWS[summary] = row
+            while len(SUMMARY_ROWS) > SUMMARY_ROWS_SIZE:
+                SUMMARY_ROWS.popitem(last=False)
+
+    if not summaries:
+        return sp.csr_matrix((0, SUMMARY_HASH_FEATURES))
+    ordered = [rows[summary] for summary in summaries]
+    indptr = np.concatenate([[0], np.cumsum([len(indices) for indices, _ in ordered])])
+    return sp.csr_matrix((np.concatenate([values for _, values in ordered]),
+                          np.concatenate([indices for indices, _ in ordered]), indptr),
+                         shape=(len(summaries), SUMMARY_HASH_FEATURES))
+
+def build_content_matrix(works, profile, feature_weights=None, n_jobs=1, tfidf=None, summaries=None):
+    """
+    Stack the works' row-normalized tag TF-IDF block (tfidf, if already computed) and hashed
+    summary block (summaries, if already computed) side by side, each scaled by its weight in
+    feature_weights. A zero summary weight skips hashing entirely.
+    """
+    import scipy.sparse as sp
+    from sklearn.preprocessing import normalize
+    feature_weights = {**FEATURE_WEIGHTS, **(feature_weights or {})}
+    if tfidf is None:
+        tfidf = tags_to_tfidf(works, profile)
+    blocks = [feature_weights["tags"] * normalize(tfidf)]
+    if feature_weights["summary"]:
+        if summaries is None:
+            summaries = hash_summaries(works, n_jobs)
+        blocks.append(feature_weights["summary"] * summaries)
+    return sp.hstack(blocks, format="csr")
+
+def content_profile(profile, feature_weights=None):
+    """The reader's profile vector in the same weighted tag + summary space as build_content_matrix."""
+    import numpy as np
+    feature_weights = {**FEATURE_WEIGHTS, **(feature_weights or {})}
+    blocks = [feature_weights["tags"] * profile["tag_profile"]]
+    if feature_weights["summary"]:
+        blocks.append(feature_weights["summary"] * profile["summary_profile"])
+    return np.concatenate(blocks)
+
+def build_tag_profile(works_data, n_topics=150, models=None, vectorizer_options=None, feature_weights=None):
+    """
+    Fit the tag TF-IDF vectorizer (with extra TfidfVectorizer vectorizer_options, e.g. min_df) and
+    LDA topic model on works_data and summarize the reader's taste as their mean TF-IDF vector and
+    mean topic distribution. Returns None if no work has tags (or none survive the vectorizer's cutoffs).
+    With already fitted `models` ({"vectorizer": ..., "lda": ...}, e.g. a loaded catalog index),
+    the works are only transformed, which is much faster. Summaries are only hashed into the
+    profile when feature_weights gives them a weight.
+    """
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.decomposition import LatentDirichletAllocation
     # Prepare tag documents (tags joined by comma)
     tag_docs = [", ".join(work["tags"]) for work in works_data]
     if not tag_docs or all(doc.strip() == "" for doc in tag_docs):
-        print("No tags found for recommendations.")
+        return None
+
+    if models is not None:
+        tfidf_vectorizer = models["vectorizer"]
+        lda = models["lda"]
+        with METRICS.timer("stage_seconds", stage="vectorize"), profiling.stage("vectorize"):
+            tfidf_matrix = tfidf_vectorizer.transform(tag_docs)
+        with METRICS.timer("stage_seconds", stage="lda_transform"), profiling.stage("lda_transform"):
+            lda_topics = lda.transform(tfidf_matrix)
+    else:
+        # Vectorize tags using TF-IDF (treat each tag as a token)
+        tfidf_vectorizer = TfidfVectorizer(tokenizer=split_tags, token_pattern=None, **(vectorizer_options or {}))
+        with METRICS.timer("stage_seconds", stage="vectorize"), profiling.stage("vectorize"):
+            try:
+                tfidf_matrix = tfidf_vectorizer.fit_transform(tag_docs)
+            except ValueError:
+                # min_df/max_df pruned every tag
+                return None
+
+        # Use LDA on the TF-IDF matrix
+        lda = LatentDirichletAllocation(n_components=n_topics, random_state=42)
+        with METRICS.timer("stage_seconds", stage="lda_fit"), profiling.stage("lda_fit"):
+            lda_topics = lda.fit_transform(tfidf_matrix)
+
+    return {
+        "vectorizer": tfidf_vectorizer,
+        "lda": lda,
+        "topics": np.mean(lda_topics, axis=0),
+        "tag_profile": np.asarray(tfidf_matrix.mean(axis=0)).ravel(),
+        "summary_profile": (np.asarray(hash_summaries(works_data).mean(axis=0)).ravel()
+                            if {**FEATURE_WEIGHTS, **(feature_weights or {})}["summary"] else None),
+        # (tags x topics) row-normalized topic-word weights, used to fold candidates into topic space cheaply
+        "tag_topics": np.ascontiguousarray((lda.components_ / lda.components_.sum(axis=1, keepdims=True)).T),
+        "feature_names": np.array(tfidf_vectorizer.get_feature_names_out()),
+    }
+
+def tags_to_tfidf(works, profile):
+    """
+    Build the (works x tags) TF-IDF matrix of works in the profile's tag vocabulary directly as CSR.
+    Tags (already stripped, as parsed from blurbs) outside the vocabulary are ignored.
+    Much faster than vectorizer.transform for large pools.
+    """
+    import numpy as np
+    import scipy.sparse as sp
+    vocabulary = profile["vectorizer"].vocabulary_
+    idf = profile["vectorizer"].idf_
+    lookup = vocabulary.get
+    columns = []
+    indptr = [0]
+    for work in works:
+        ids = {lookup(tag) for tag in work["tags"]}
+        ids.discard(None)
+        columns.extend(ids)
+        indptr.append(len(columns))
+    columns = np.asarray(columns, dtype=np.int32)
+    return sp.csr_matrix((idf[columns], columns, np.asarray(indptr, dtype=np.int64)),
+                         shape=(len(works), len(idf)))
+
+def _cosine_to(matrix, vector):
+    """Cosine similarity of every row of a sparse or dense matrix to a dense vector."""
+    import numpy as np
+    import scipy.sparse as sp
+    dots = np.asarray(matrix @ vector).ravel()
+    if sp.issparse(matrix):
+        row_norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    else:
+        row_norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))
+    norms = row_norms * (np.linalg.norm(vector) or 1.0)
+    return np.divide(dots, norms, out=np.zeros_like(dots, dtype=np.float64), where=norms > 0)
+
+def rerank_candidates(candidates, profile, n_recommendations=5, weights=None, feature_weights=None, n_jobs=1,
+                      summaries=None):
+    """
+    Score every candidate in one vectorized pass and return the best n_recommendations.
+    The score combines cosine similarity to the reader's combined tag + summary content profile,
+    cosine similarity to their topic mixture, and log-scaled kudos normalized to [0, 1],
+    weighted by `weights`. Summary hashing dominates the cost for large pools, although each
+    summary is only hashed once per process (see hash_summaries); spread it over n_jobs
+    processes, pass the candidates' already hashed `summaries`, or set feature_weights={"summary": 0}
+    to rank on tags alone.
+    """
+    import numpy as np
+    if not candidates:
         return []
+    weights = {**RERANK_WEIGHTS, **(weights or {})}
 
-    # Vectorize tags using TF-IDF (treat each tag as a token)
-    tfidf_vectorizer = TfidfVectorizer(tokenizer=lambda x: [tag.strip() for tag in x.split(",") if tag.strip()],
-                                       token_pattern=None)
-    tfidf_matrix = tfidf_vectorizer.fit_transform(tag_docs)
+    with METRICS.timer("stage_seconds", stage="rerank"), profiling.stage("rerank"):
+        tfidf = tags_to_tfidf(candidates, profile)
+        content = build_content_matrix(candidates, profile, feature_weights, n_jobs, tfidf, summaries)
+        content_similarity = _cosine_to(content, content_profile(profile, feature_weights))
+        topic_similarity = _cosine_to(tfidf @ profile["tag_topics"], profile["topics"])
+        popularity = np.log1p(np.fromiter((work["kudos"] for work in candidates), dtype=np.float64,
+                                          count=len(candidates)))
+        if popularity.max() > 0:
+            popularity /= popularity.max()
 
-    # Use LDA on the TF-IDF matrix
-    lda = LatentDirichletAllocation(n_components=n_topics, random_state=42)
-    lda_topics = lda.fit_transform(tfidf_matrix)
+        scores = (weights["content"] * content_similarity
+                  + weights["topics"] * topic_similarity
+                  + weights["popularity"] * popularity)
 
-    # Get top topic(s) for the input works
-    avg_topic_dist = np.mean(lda_topics, axis=0)
-    top_topic = np.argmax(avg_topic_dist)
+    k = min(n_recommendations, len(candidates))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [candidates[i] for i in top]
 
-    # Build a set of existing work links to avoid recommending duplicates
-    existing_links = set(work["link"] for work in works_data)
+def fetch_author_works(author, cache=SEARCH_CACHE, base_url=None):
+    """Return the parsed works on the first page of an author's AO3 works list on base_url, or [] on failure."""
+    from bs4 import BeautifulSoup
+    # Blurbs show pseuds as "pseud (username)"; the works list lives under the username
+    username = author.rsplit("(", 1)[-1].rstrip(")").strip() if author.endswith(")") else author
+    key = json.dumps({"host": base_url or AO3_BASE_URL, "author": username})
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    url = f"{base_url or AO3_BASE_URL}/users/{quote(username)}/works"
+    with profiling.stage("search"):
+        response = http_get(url, verify=False)
+    if response.status_code != 200:
+        log.warning("Failed to fetch works by %s: Status %d", username, response.status_code)
+        return []
+
+    with METRICS.timer("parse_seconds", page="author"), profiling.stage("parse"):
+        works = parse_search_blurbs(BeautifulSoup(response.content, "html.parser"))
+    METRICS.inc("blurbs_parsed_total", len(works), page="author")
+    if cache is not None:
+        cache.set(key, works)
+    return works
+
+# AO3 spells these characters out in tag URLs
+TAG_URL_ESCAPES = {"/": "*s*", "&": "*a*", ".": "*d*", "?": "*q*", "#": "*h*"}
+
+def tag_url(tag, base_url=None):
+    for char, escape in TAG_URL_ESCAPES.items():
+        tag = tag.replace(char, escape)
+    return f"{base_url or AO3_BASE_URL}/tags/{quote(tag)}"
+
+def tag_cache_key(tag, base_url=None):
+    # Tag names are case-insensitive on AO3
+    return json.dumps({"host": base_url or AO3_BASE_URL, "tag": tag.strip().lower()})
 
-    # Get top tags for the top topic using TF-IDF feature names
-    feature_names = np.array(tfidf_vectorizer.get_feature_names_out())
-    topic_word_dist = lda.components_[top_topic]
-    sorted_indices = topic_word_dist.argsort()[::-1]
-    top_tag_indices = sorted_indices[:5]
-    top_tags = [feature_names[i] for i in top_tag_indices]
+def parse_tag_page(soup, tag):
+    """
+    Read a tag's wrangling from its AO3 page: the canonical name it is a synonym of (itself if it
+    is canonical or unwrangled), its synonyms, and its parent and meta tags.
+    """
+    heading = soup.select_one("div.tag h2.heading")
+    name = heading.get_text(strip=True) if heading else tag
+    merger = soup.select_one("div.merger a.tag")
+    intro = soup.select_one("div.tag p")
+
+    def names(selector):
+        return [link.get_text(strip=True) for link in soup.select(selector)]
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; AO3Scraper/1.0)"
+    return {
+        "name": name,
+        "canonical": merger.get_text(strip=True) if merger else name,
+        "is_canonical": merger is None and intro is not None and "canonical tag" in intro.get_text(),
+        "synonyms": names("div.synonym a.tag"),
+        "parents": names("div.parent a.tag"),
+        "meta": names("div.meta a.tag"),
     }
-    proxies = {
-        "http": None,
-        "https": None
+
+def fetch_tag_info(tag, cache=TAG_CACHE, base_url=None):
+    """
+    Return the wrangling of tag (see parse_tag_page), fetching its page only if it is not cached.
+    A canonical tag's page also lists its synonyms, which are cached with it so their pages are
+    never fetched. Tags unknown to AO3 map to themselves; returns None if the page could not be fetched.
+    """
+    import requests
+    from bs4 import BeautifulSoup
+    key = tag_cache_key(tag, base_url)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        with profiling.stage("crawl"):
+            response = http_get(tag_url(tag, base_url), verify=False)
+    except requests.RequestException as exc:
+        log.warning("Failed to fetch tag %s: %s", tag, exc)
+        return None
+    if response.status_code == 404:
+        info = {"name": tag, "canonical": tag, "is_canonical": False, "synonyms": [], "parents": [], "meta": []}
+    elif response.status_code != 200:
+        log.warning("Failed to fetch tag %s: Status %d", tag, response.status_code)
+        return None
+    else:
+        with METRICS.timer("parse_seconds", page="tag"), profiling.stage("parse"):
+            info = parse_tag_page(BeautifulSoup(response.content, "html.parser"), tag)
+    if cache is not None:
+        cache.set(key, info)
+        if info["is_canonical"]:
+            for synonym in info["synonyms"]:
+                synonym_key = tag_cache_key(synonym, base_url)
+                if cache.get(synonym_key) is None:
+                    cache.set(synonym_key, {**info, "name": synonym, "is_canonical": False, "synonyms": []})
+    return info
+
+def wrangle_tags(tags, max_workers=4, cache=TAG_CACHE, base_url=None, fetch=True):
+    """
+    Map each distinct tag to its wrangling (see fetch_tag_info). Tag pages that are not cached are
+    fetched max_workers at a time, each at most once; with fetch=False only cached tags are mapped.
+    Tags whose page could not be fetched are left out.
+    """
+    tags = list(tags)
+    distinct = {}
+    for tag in tags:
+        distinct.setdefault(tag.strip().lower(), tag.strip())
+    wrangled = {}
+    missing = []
+    for folded, tag in distinct.items():
+        info = cache.get(tag_cache_key(tag, base_url)) if cache is not None else None
+        if info is not None:
+            wrangled[folded] = info
+        elif fetch:
+            missing.append(tag)
+    if missing:
+        log.info("Fetching wrangling for %d tags", len(missing))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for tag, info in zip(missing, executor.map(lambda tag: fetch_tag_info(tag, cache, base_url), missing)):
+                if info is not None:
+                    wrangled[tag.lower()] = info
+    return {tag: wrangled[tag.strip().lower()] for tag in tags if tag.strip().lower() in wrangled}
+
+def canonicalize_tags(works, max_workers=4, cache=TAG_CACHE, base_url=None, fetch=True):
+    """
+    Copies of works with every tag replaced by its canonical name, dropping tags that become
+    duplicates, so synonyms share one TF-IDF feature and searches use filterable names.
+    """
+    works = list(works)
+    wrangled = wrangle_tags({tag for work in works for tag in work["tags"]}, max_workers, cache, base_url, fetch)
+    canonical_works = []
+    for work in works:
+        tags = {}
+        for tag in work["tags"]:
+            name = wrangled[tag]["canonical"] if tag in wrangled else tag
+            tags.setdefault(name.lower(), name)
+        canonical_works.append({**work, "tags": list(tags.values())})
+    return canonical_works
+
+def topic_queries(topic_dist, profile, n_search_topics=3, n_tags=5):
+    """
+    Turn the n_search_topics strongest topics of topic_dist into tag queries (each topic's
+    n_tags highest-weighted tags), mapped to the topic's share. Topics sharing a query share a search.
+    """
+    import numpy as np
+    top_topics = np.argsort(topic_dist)[::-1][:max(n_search_topics, 1)]
+    query_weights = {}
+    for topic in top_topics:
+        sorted_indices = profile["lda"].components_[topic].argsort()[::-1]
+        top_tags = tuple(profile["feature_names"][i] for i in sorted_indices[:n_tags])
+        query_weights[top_tags] = query_weights.get(top_tags, 0.0) + float(topic_dist[topic])
+    return query_weights
+
+def gather_candidates(works_data, profile, pool_size=100, n_search_topics=3, max_workers=None, max_pages=3,
+                      catalog=None, max_authors=3, n_query_tags=5, cooccurrence=None, seen=None, base_url=None):
+    """
+    Stage one of recommendation: cheaply collect a large pool of unseen candidate works from
+    tag searches (of n_query_tags tags) for the reader's strongest topics, the local catalog index
+    (if `catalog` is given) and the other works of the reader's most frequent authors, fetching
+    from base_url (default AO3_BASE_URL).
+    Short searches are widened with related tags from `cooccurrence`, if given (see query_rungs).
+    Works in `seen` (a SeenWorks) are never candidates.
+    """
+    existing_links = set(work["link"] for work in works_data)
+    query_weights = topic_queries(profile["topics"], profile, n_search_topics, n_query_tags)
+    queries = list(query_weights)
+    cooccurrence = load_cooccurrence(cooccurrence)
+    rungs = [query_rungs(tags, cooccurrence) for tags in queries]
+
+    authors = favourite_authors(works_data, max_authors)
+
+    n_searches = sum(len(ladder_rungs) for ladder_rungs in rungs) + len(authors)
+    METRICS.inc("search_queries_total", n_searches)
+    METRICS.observe("search_queries_per_recommendation", n_searches)
+    executor = ThreadPoolExecutor(max_workers=max_workers or SEARCH_CONCURRENCY)
+    try:
+        ladders = start_search_ladders(executor, queries, existing_links, pool_size, max_pages, rungs, seen, base_url)
+        author_futures = [executor.submit(fetch_author_works, author, base_url=base_url) for author in authors]
+
+        # The local index needs no network, so query it while the searches are in flight
+        index_works = []
+        if catalog is not None:
+            index_works = recommend_works_from_index(works_data, catalog, n_recommendations=pool_size)
+
+        result_lists = [collect_search_ladder(ladder, pool_size) for ladder in ladders]
+        author_works = [work for future in author_futures for work in future.result()]
+    finally:
+        executor.shutdown(wait=False)
+
+    candidates = merge_round_robin(result_lists, [query_weights[q] for q in queries], pool_size)
+    return add_candidates(candidates, index_works + author_works, existing_links, seen)
+
+def favourite_authors(works_data, max_authors=3):
+    """The max_authors authors (other than Anonymous) with the most works in works_data."""
+    author_counts = Counter(work["author"] for work in works_data if work.get("author", "Anonymous") != "Anonymous")
+    return [author for author, _ in author_counts.most_common(max_authors)]
+
+def add_candidates(candidates, works, existing_links, seen=None):
+    """Append the works that are not already candidates, in existing_links or in `seen`, and return candidates."""
+    seen_links = set(existing_links)
+    seen_links.update(work["link"] for work in candidates)
+    for work in works:
+        if work["link"] not in seen_links and not (seen is not None and seen.seen_link(work["link"])):
+            seen_links.add(work["link"])
+            candidates.append(work)
+    return candidates
+
+# Recommendation settings a tuned configuration file (written by tune.py) may set
+TUNABLE_SETTINGS = ("n_topics", "n_search_topics", "n_query_tags", "vectorizer_options")
+
+def load_tuned_config(config, **defaults):
+    """
+    Return defaults updated with the TUNABLE_SETTINGS found in a tuned configuration: a path to
+    tune.py's JSON output, a dict, or None for no changes.
+    """
+    if config is None:
+        return defaults
+    if isinstance(config, str):
+        with open(config, encoding="utf-8") as f:
+            config = json.load(f)
+    return {**defaults, **{key: config[key] for key in TUNABLE_SETTINGS if key in config}}
+
+def recommend_works_by_tags(works_data, n_topics=150, n_recommendations=5, n_search_topics=3, max_workers=None,
+                            max_pages=3, pool_size=None, catalog=None, weights=None, feature_weights=None,
+                            n_query_tags=5, vectorizer_options=None, config=None, canonical_tags=False,
+                            cooccurrence=None, seen=None, n_jobs=1, base_url=None):
+    """
+    Recommend new AO3 works based on tag similarity using TF-IDF and LDA.
+    Only recommends works not already in works_data.
+    Candidates are gathered from concurrent tag searches for the n_search_topics strongest topics
+    (each reading at most max_pages result pages), the optional local catalog index and the reader's
+    favourite authors, then re-ranked against the reader's tag, summary and topic profile.
+    A tuned `config` (see load_tuned_config) overrides n_topics, n_search_topics, n_query_tags
+    and vectorizer_options. With canonical_tags, tags are replaced by their canonical names
+    (see canonicalize_tags) before vectorizing, so queries are built from canonical tags too;
+    candidates are canonicalized from the tag cache only. A tag co-occurrence matrix (a
+    TagCooccurrence or its directory) widens searches that come back short with related tags.
+    Works in `seen` (a SeenWorks of everything the reader has read or been recommended) are skipped,
+    and the reader's works and the new recommendations are added to it; call seen.save() to keep them.
+    Summaries are hashed in n_jobs processes (see rerank_candidates). Searches, author and tag pages
+    are fetched from base_url (default AO3_BASE_URL).
+    """
+    settings = load_tuned_config(config, n_topics=n_topics, n_search_topics=n_search_topics,
+                                 n_query_tags=n_query_tags, vectorizer_options=vectorizer_options)
+    n_topics, n_search_topics, n_query_tags, vectorizer_options = (settings[key] for key in TUNABLE_SETTINGS)
+    if canonical_tags:
+        works_data = canonicalize_tags(works_data, max_workers or 4, base_url=base_url)
+    profile = build_tag_profile(works_data, n_topics, vectorizer_options=vectorizer_options,
+                                feature_weights=feature_weights)
+    if profile is None:
+        log.warning("No tags found for recommendations.")
+        return []
+
+    if pool_size is None:
+        pool_size = max(10 * n_recommendations, 50)
+    METRICS.inc("recommendations_total")
+    with METRICS.timer("stage_seconds", stage="candidates"):
+        candidates = gather_candidates(works_data, profile, pool_size, n_search_topics, max_workers, max_pages,
+                                       catalog, n_query_tags=n_query_tags, cooccurrence=cooccurrence, seen=seen,
+                                       base_url=base_url)
+    if canonical_tags:
+        candidates = canonicalize_tags(candidates, base_url=base_url, fetch=False)
+    log.info("Re-ranking %d candidate works", len(candidates))
+    recommendations = rerank_candidates(candidates, profile, n_recommendations, weights, feature_weights, n_jobs)
+    if seen is not None:
+        seen.add_works(works_data)
+        seen.add_works(recommendations)
+    return recommendations
+
+def recommend_works_for_users(users_works, n_topics=150, n_recommendations=5, n_search_topics=3,
+                              max_workers=None, max_pages=3, pool_size=None, weights=None, feature_weights=None,
+                              models=None, n_query_tags=5, vectorizer_options=None, config=None,
+                              canonical_tags=False, cooccurrence=None, seen=None, catalog=None, max_authors=3,
+                              n_jobs=1, base_url=None):
+    """
+    Recommend works for many readers at once; users_works is a list of work lists, one per reader,
+    and one recommendation list is returned per reader, in the same order.
+    The vectorizer and topic model are fitted once on every reader's works (or taken from already
+    fitted `models`), all topic profiles come from a single transform of the reader-by-tag matrix,
+    and identical tag queries from different readers are searched only once, all concurrently.
+    Each reader also draws candidates from the optional `catalog` index and from their favourite
+    authors, as in recommend_works_by_tags; an author shared by several readers is fetched once.
+    A tuned `config`, canonical_tags and cooccurrence work as in recommend_works_by_tags; the tags of
+    every reader are wrangled together, so each tag page is fetched once for the whole batch.
+    `seen` is a list with one SeenWorks (or None) per reader, used as in recommend_works_by_tags.
+    Every reader is filtered before any is added to, so readers may share one SeenWorks: each is
+    then filtered against what it held before the call, not against the other readers' results.
+    Summaries are hashed in n_jobs processes, and a work found for several readers is hashed once.
+    Pages are fetched from base_url (default AO3_BASE_URL).
+    """
+    import numpy as np
+    import scipy.sparse as sp
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.decomposition import LatentDirichletAllocation
+    settings = load_tuned_config(config, n_topics=n_topics, n_search_topics=n_search_topics,
+                                 n_query_tags=n_query_tags, vectorizer_options=vectorizer_options)
+    n_topics, n_search_topics, n_query_tags, vectorizer_options = (settings[key] for key in TUNABLE_SETTINGS)
+    users_works = [list(works) for works in users_works]
+    if canonical_tags:
+        canonical_works = iter(canonicalize_tags([work for works in users_works for work in works], max_workers or 4,
+                                                 base_url=base_url))
+        users_works = [[next(canonical_works) for _ in works] for works in users_works]
+    all_works = [work for works in users_works for work in works]
+    tag_docs = [", ".join(work["tags"]) for work in all_works]
+    if not tag_docs or all(doc.strip() == "" for doc in tag_docs):
+        log.warning("No tags found for recommendations.")
+        return [[] for _ in users_works]
+    if pool_size is None:
+        pool_size = max(10 * n_recommendations, 50)
+
+    if models is not None:
+        tfidf_vectorizer = models["vectorizer"]
+        lda = models["lda"]
+        with METRICS.timer("stage_seconds", stage="vectorize"), profiling.stage("vectorize"):
+            tfidf_matrix = tfidf_vectorizer.transform(tag_docs)
+    else:
+        tfidf_vectorizer = TfidfVectorizer(tokenizer=split_tags, token_pattern=None, **(vectorizer_options or {}))
+        with METRICS.timer("stage_seconds", stage="vectorize"), profiling.stage("vectorize"):
+            try:
+                tfidf_matrix = tfidf_vectorizer.fit_transform(tag_docs)
+            except ValueError:
+                log.warning("No tags left after the vectorizer's cutoffs.")
+                return [[] for _ in users_works]
+        lda = LatentDirichletAllocation(n_components=n_topics, random_state=42)
+        with METRICS.timer("stage_seconds", stage="lda_fit"), profiling.stage("lda_fit"):
+            lda.fit(tfidf_matrix)
+
+    # (readers x works) averaging matrix turns work rows into each reader's mean tag vector
+    sizes = np.array([len(works) for works in users_works])
+    membership = sp.csr_matrix(
+        (np.repeat(1.0 / np.maximum(sizes, 1), sizes), np.arange(len(all_works)),
+         np.concatenate([[0], np.cumsum(sizes)])),
+        shape=(len(users_works), len(all_works)),
+    )
+    user_tags = membership @ tfidf_matrix
+    with METRICS.timer("stage_seconds", stage="lda_transform"), profiling.stage("lda_transform"):
+        user_topics = lda.transform(user_tags)
+    summary_weight = {**FEATURE_WEIGHTS, **(feature_weights or {})}["summary"]
+    user_summaries = membership @ hash_summaries(all_works, n_jobs) if summary_weight else None
+
+    shared = {
+        "vectorizer": tfidf_vectorizer,
+        "lda": lda,
+        "tag_topics": np.ascontiguousarray((lda.components_ / lda.components_.sum(axis=1, keepdims=True)).T),
+        "feature_names": np.array(tfidf_vectorizer.get_feature_names_out()),
     }
+    profiles = []
+    user_queries = []
+    for u in range(len(users_works)):
+        profile = {
+            **shared,
+            "topics": user_topics[u],
+            "tag_profile": user_tags[u].toarray().ravel(),
+            "summary_profile": user_summaries[u].toarray().ravel() if summary_weight else None,
+        }
+        profiles.append(profile)
+        user_queries.append(topic_queries(profile["topics"], profile, n_search_topics, n_query_tags)
+                            if sizes[u] else {})
+
+    # Search each distinct query once; readers' own works are filtered out afterwards
+    queries = list(dict.fromkeys(query for query_weights in user_queries for query in query_weights))
+    log.info("Searching %d distinct tag queries for %d readers", len(queries), len(users_works))
+    cooccurrence = load_cooccurrence(cooccurrence)
+    rungs = {query: query_rungs(query, cooccurrence) for query in queries}
+    user_authors = [favourite_authors(works, max_authors) for works in users_works]
+    authors = list(dict.fromkeys(author for names in user_authors for author in names))
+    n_searches = sum(len(ladder_rungs) for ladder_rungs in rungs.values()) + len(authors)
+    METRICS.inc("search_queries_total", n_searches)
+    METRICS.inc("recommendations_total", len(users_works))
+    for query_weights, names in zip(user_queries, user_authors):
+        METRICS.observe("search_queries_per_recommendation",
+                        sum(len(rungs[query]) for query in query_weights) + len(names))
+    if isinstance(catalog, str):
+        catalog = load_catalog_index(catalog)
+    executor = ThreadPoolExecutor(max_workers=max_workers or SEARCH_CONCURRENCY)
+    try:
+        with METRICS.timer("stage_seconds", stage="search"):
+            ladders = start_search_ladders(executor, queries, set(), pool_size, max_pages, list(rungs.values()),
+                                           base_url=base_url)
+            author_futures = {author: executor.submit(fetch_author_works, author, base_url=base_url)
+                              for author in authors}
+            # The local index needs no network, so query it while the searches are in flight
+            index_works = [recommend_works_from_index(works, catalog, n_recommendations=pool_size)
+                           if catalog is not None and works else [] for works in users_works]
+            results = {query: collect_search_ladder(ladder, pool_size) for query, ladder in zip(queries, ladders)}
+            author_works = {author: future.result() for author, future in author_futures.items()}
+    finally:
+        executor.shutdown(wait=False)
 
     recommendations = []
-    tags_to_try = top_tags.copy()
-    while tags_to_try:
-        search_tags = ", ".join(tags_to_try)
-        encoded_tags = quote_plus(search_tags)
-        print(f"Searching AO3 for new works with tags: {', '.join(tags_to_try)}")
-
-        search_url = (
-            "https://archiveofourown.gay/works/search?"
-            "work_search%5Bquery%5D=&"
-            "work_search%5Btitle%5D=&"
-            "work_search%5Bcreators%5D=&"
-            "work_search%5Brevised_at%5D=&"
-            "work_search%5Bcomplete%5D=&"
-            "work_search%5Bcrossover%5D=&"
-            "work_search%5Bsingle_chapter%5D=0&"
-            "work_search%5Bword_count%5D=&"
-            "work_search%5Blanguage_id%5D=&"
-            "work_search%5Bfandom_names%5D=&"
-            "work_search%5Brating_ids%5D=&"
-            "work_search%5Bcharacter_names%5D=&"
-            "work_search%5Brelationship_names%5D=&"
-            f"work_search%5Bfreeform_names%5D={encoded_tags}&"
-            "work_search%5Bhits%5D=&"
-            "work_search%5Bkudos_count%5D=&"
-            "work_search%5Bcomments_count%5D=&"
-            "work_search%5Bbookmarks_count%5D=&"
-            "work_search%5Bsort_column%5D=kudos_count&"
-            "work_search%5Bsort_direction%5D=desc&"
-            "commit=Search"
-        )
-
-        print(f"Fetching search results from: {search_url}")
-
-        response = requests.get(search_url, headers=headers, proxies=proxies, verify=False)
-        if response.status_code != 200:
-            print(f"Failed to fetch search results: Status {response.status_code}")
-            break
+    for u, (works, profile, query_weights) in enumerate(zip(users_works, profiles, user_queries)):
+        existing_links = set(work["link"] for work in works)
+        user_seen = seen[u] if seen is not None else None
+        result_lists = [[work for work in results[query] if work["link"] not in existing_links
+                         and not (user_seen is not None and user_seen.seen_link(work["link"]))]
+                        for query in query_weights]
+        candidates = merge_round_robin(result_lists, list(query_weights.values()), pool_size)
+        candidates = add_candidates(candidates, index_works[u] + [work for author in user_authors[u]
+                                                                  for work in author_works[author]],
+                                    existing_links, user_seen)
+        if canonical_tags:
+            candidates = canonicalize_tags(candidates, base_url=base_url, fetch=False)
+        recommendations.append(rerank_candidates(candidates, profile, n_recommendations, weights, feature_weights,
+                                                 n_jobs))
+    if seen is not None:
+        for works, user_seen, user_recommendations in zip(users_works, seen, recommendations):
+            if user_seen is not None:
+                user_seen.add_works(works)
+                user_seen.add_works(user_recommendations)
+    return recommendations
+
+def build_catalog_index(catalog_works, index_dir, n_topics=150, chunk_size=2048,
+                        n_tables=8, n_bits=12, seed=42):
+    """
+    Fit the tag vectorizer and topic model on a catalog of works and build a persisted
+    LSH index over every work's topic distribution in index_dir.
+    catalog_works may be any iterable and is read once: works are written to works.jsonl as they
+    arrive while each tag's document frequency is counted, and the topic model is then fitted
+    and applied in passes over that file, chunk_size works at a time. Memory stays bounded by
+    the chunk and the tag vocabulary rather than the catalog.
+    """
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.decomposition import LatentDirichletAllocation
+    from topic_index import TopicIndex
+    catalog_works = iter(catalog_works)
+    first = next(catalog_works, None)
+    if first is None:
+        raise ValueError("Cannot build an index over an empty catalog.")
+    os.makedirs(index_dir, exist_ok=True)
+    works_path = os.path.join(index_dir, "works.jsonl")
+
+    document_counts = Counter()
+    n_works = 0
+    with METRICS.timer("stage_seconds", stage="vectorize"), profiling.stage("vectorize"):
+        with open(works_path, "w", encoding="utf-8") as f:
+            for work in itertools.chain([first], catalog_works):
+                f.write(json.dumps(work) + "\n")
+                # The vectorizer lowercases before splitting, so count the tags the same way
+                document_counts.update(set(split_tags(", ".join(work["tags"]).lower())))
+                n_works += 1
+        # The same vocabulary and smoothed IDF that fitting on every document at once would give
+        vocabulary = sorted(document_counts)
+        tfidf_vectorizer = TfidfVectorizer(tokenizer=split_tags, token_pattern=None, vocabulary=vocabulary)
+        tfidf_vectorizer.fit([""])
+        frequencies = np.array([document_counts[tag] for tag in vocabulary], dtype=np.float64)
+        tfidf_vectorizer.idf_ = np.log((n_works + 1) / (frequencies + 1)) + 1
+
+    def tfidf_chunks():
+        chunk = []
+        with open(works_path, encoding="utf-8") as f:
+            for line in f:
+                chunk.append(", ".join(json.loads(line)["tags"]))
+                if len(chunk) >= chunk_size:
+                    yield tfidf_vectorizer.transform(chunk)
+                    chunk = []
+        if chunk:
+            yield tfidf_vectorizer.transform(chunk)
+
+    # Online LDA so the model never needs the whole TF-IDF matrix at once
+    lda = LatentDirichletAllocation(n_components=n_topics, learning_method="online",
+                                    total_samples=n_works, random_state=seed)
+    with METRICS.timer("stage_seconds", stage="lda_fit"), profiling.stage("lda_fit"):
+        for chunk in tfidf_chunks():
+            lda.partial_fit(chunk)
+
+    index = TopicIndex.build(index_dir, (lda.transform(chunk) for chunk in tfidf_chunks()), n_items=n_works,
+                             n_dims=n_topics, n_tables=n_tables, n_bits=n_bits, seed=seed)
+
+    with open(os.path.join(index_dir, "model.pkl"), "wb") as f:
+        pickle.dump({"vectorizer": tfidf_vectorizer, "lda": lda}, f)
+    log.info("Indexed %d works into %s", len(index), index_dir)
+    return index
+
+def load_catalog_index(index_dir):
+    """Load the models, LSH index and work metadata written by build_catalog_index."""
+    from topic_index import TopicIndex
+    with open(os.path.join(index_dir, "model.pkl"), "rb") as f:
+        models = pickle.load(f)
+    with open(os.path.join(index_dir, "works.jsonl"), encoding="utf-8") as f:
+        catalog_works = [json.loads(line) for line in f if line.strip()]
+    return {
+        "vectorizer": models["vectorizer"],
+        "lda": models["lda"],
+        "index": TopicIndex.load(index_dir),
+        "works": catalog_works,
+    }
+
+def recommend_works_from_index(works_data, catalog, n_recommendations=5, n_probes=2, max_candidates=None):
+    """
+    Recommend catalog works whose topic distribution is nearest to the average topic mixture
+    of works_data. `catalog` is an index directory or the result of load_catalog_index.
+    Raise n_probes (or max_candidates) for better recall, lower them for faster queries.
+    """
+    import numpy as np
+    if isinstance(catalog, str):
+        catalog = load_catalog_index(catalog)
+
+    tag_docs = [", ".join(work["tags"]) for work in works_data]
+    if not tag_docs or all(doc.strip() == "" for doc in tag_docs):
+        log.warning("No tags found for recommendations.")
+        return []
+
+    user_topics = catalog["lda"].transform(catalog["vectorizer"].transform(tag_docs))
+    avg_topic_dist = np.mean(user_topics, axis=0)
+
+    existing_links = set(work["link"] for work in works_data)
+    exclude = [i for i, work in enumerate(catalog["works"]) if work["link"] in existing_links]
+    neighbours = catalog["index"].query(avg_topic_dist, k=n_recommendations, n_probes=n_probes,
+                                        max_candidates=max_candidates, exclude=exclude)
+    return [catalog["works"][row] for row, _ in neighbours]
+
+# Queued fetches by URL path: a work page, a collection listing page or a user's bookmarks page
+CRAWL_JOB_KINDS = (
+    ("work", re.compile(r"(/works/\d+)(?:/chapters/\d+|/navigate)?")),
+    ("collection", re.compile(r"/collections/([^/]+)(?:/works)?")),
+    ("bookmarks", re.compile(r"/users/([^/]+)/bookmarks")),
+)
+
+# Work and bookmarks pages are fetched for someone waiting on them, collections are refreshed in the background
+CRAWL_PRIORITIES = {"work": PRIORITY_INTERACTIVE, "bookmarks": PRIORITY_INTERACTIVE,
+                    "collection": PRIORITY_BACKGROUND}
+
+class CrawlJobFailed(Exception):
+    """A queued fetch answered with an error status. Missing pages are not retried."""
+
+    def __init__(self, url, status, retry_after=None):
+        super().__init__(f"Status {status} fetching {url}")
+        self.status = status
+        self.retry_after = retry_after
+        self.permanent = status in (403, 404, 410)
+
+def crawl_job(value):
+    """
+    Return (url, kind) of the queue job fetching value: a work, collection or bookmarks URL, or a
+    bare collection name. URLs are normalized to the canonical address so each page is queued once;
+    chapter links are queued as their work.
+    """
+    parts = urlsplit(value if "/" in value else f"/collections/{quote(value)}")
+    path = parts.path.rstrip("/")
+    for kind, pattern in CRAWL_JOB_KINDS:
+        match = pattern.fullmatch(path)
+        if match:
+            if kind == "work":
+                path = match.group(1)
+            elif kind == "collection":
+                path = f"/collections/{match.group(1)}/works"
+            page = parse_qs(parts.query).get("page", ["1"])[0]
+            if kind != "work" and page.isdigit() and int(page) > 1:
+                path += f"?page={int(page)}"
+            return f"https://archiveofourown.org{path}", kind
+    raise ValueError(f"Not a work, collection or bookmarks URL: {value}")
+
+def run_crawl_job(job, crawl_queue, max_pages=None, base_url=None):
+    """
+    Fetch and parse one leased job, returning its result: a work's info dict, or the works on a
+    listing page (tagged with their "collection" or bookmarking "reader"). The first page of a
+    listing queues its other pages (at most max_pages in all) at the same priority. Raises
+    CrawlJobFailed on an error status.
+    """
+    from bs4 import BeautifulSoup
+    url = fetch_url(job["url"], base_url)
+    with profiling.stage("crawl"):
+        response = http_get(url, verify=False)
+    if response.status_code != 200:
+        retry_after = response.headers.get("Retry-After", "")
+        raise CrawlJobFailed(job["url"], response.status_code, int(retry_after) if retry_after.isdigit() else None)
 
+    with METRICS.timer("parse_seconds", page=job["kind"]), profiling.stage("parse"):
         soup = BeautifulSoup(response.content, "html.parser")
-        works = soup.select("li.work.blurb.group")
+        if job["kind"] == "work":
+            return parse_work_page(soup, job["url"])
+        name = unquote(dict(CRAWL_JOB_KINDS)[job["kind"]].fullmatch(urlsplit(job["url"]).path).group(1))
+        if job["kind"] == "collection":
+            works = [{"collection": name, **work} for work in parse_collection_blurbs(soup)]
+        else:
+            works = [{"reader": name, **work} for work in parse_bookmark_blurbs(soup)]
+        n_pages = page_count(soup)
+    METRICS.inc("blurbs_parsed_total", len(works), page=job["kind"])
 
-        for work in works:
-            link_tag = work.select_one("div.header > h4 > a")
-            if not link_tag:
-                continue
-            href = link_tag.get("href")
-            if not href:
-                continue
-            full_link = f"https://archiveofourown.org{href}"
-            if full_link in existing_links or any(r["link"] == full_link for r in recommendations):
-                continue  # Skip already known or already recommended works
+    if "?page=" not in job["url"]:
+        if max_pages is not None:
+            n_pages = min(n_pages, max_pages)
+        # Pages left over from an earlier crawl are fetched again once per refresh of the first page
+        crawl_queue.push_many([f"{job['url']}?page={page}" for page in range(2, n_pages + 1)], job["kind"],
+                              job["priority"], refresh_before=job["queued"])
+    return works
 
-            # Tags
-            tags = [tag.get_text(strip=True) for tag in work.select("ul.tags.commas > li")]
-
-            # Title
-            title = link_tag.get_text(strip=True)
-            # Author
-            author_tag = work.select_one("a[rel=author]")
-            author = author_tag.get_text(strip=True) if author_tag else "Anonymous"
-            # Fandom
-            fandom_tag = work.select_one("h5.fandoms > a")
-            fandom = fandom_tag.get_text(strip=True) if fandom_tag else ""
-            # Summary
-            summary_tag = work.select_one("blockquote.userstuff.summary")
-            summary = summary_tag.get_text(strip=True) if summary_tag else ""
-            # Hits and Kudos
-            hits_tag = work.select_one("dl.stats > dd.hits")
-            kudos_tag = work.select_one("dl.stats > dd.kudos")
-            try:
-                hits = int(hits_tag.get_text(strip=True).replace(',', '')) if hits_tag else 0
-            except Exception:
-                hits = 0
+def crawl_worker(queue_path, n_threads=4, rate=None, max_pages=None, base_url=None, wait=False, poll_seconds=1.0,
+                 lease_seconds=300, wal=True):
+    """
+    Run jobs from the CrawlQueue at queue_path on n_threads threads until no job is pending or
+    leased (or, with wait, forever), and return how many were completed. Any number of workers,
+    in this and other processes, can share the queue. With rate, fetches are limited to that
+    many per second across all of them. wal=False is for a queue shared between hosts (see CrawlQueue).
+    """
+    crawl_queue = CrawlQueue(queue_path, lease_seconds=lease_seconds, wal=wal)
+    owner_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def work(thread):
+        owner = f"{owner_prefix}:{thread}"
+        completed = 0
+        while True:
+            jobs = crawl_queue.lease(owner)
+            if not jobs:
+                if not wait and crawl_queue.drained():
+                    return completed
+                # Other workers may still queue pages, or jobs are waiting out a backoff
+                time.sleep(poll_seconds)
+                continue
+            job = jobs[0]
+            if rate:
+                time.sleep(crawl_queue.throttle("fetch", 1 / rate))
             try:
-                kudos = int(kudos_tag.get_text(strip=True).replace(',', '')) if kudos_tag else 0
-            except Exception:
-                kudos = 0
-
-            recommendations.append({
-                "link": full_link,
-                "title": title,
-                "author": author,
-                "tags": tags,
-                "fandom": fandom,
-                "summary": summary,
-                "hits": hits,
-                "kudos": kudos
-            })
+                result = run_crawl_job(job, crawl_queue, max_pages, base_url)
+            except CrawlJobFailed as exc:
+                log.warning("%s (attempt %d)", exc, job["attempts"])
+                crawl_queue.fail(job["id"], owner, str(exc), exc.retry_after, exc.permanent)
+                METRICS.inc("crawl_jobs_total", kind=job["kind"], outcome="failed")
+            except Exception as exc:
+                log.warning("Failed to fetch %s (attempt %d): %r", job["url"], job["attempts"], exc)
+                crawl_queue.fail(job["id"], owner, repr(exc))
+                METRICS.inc("crawl_jobs_total", kind=job["kind"], outcome="failed")
+            else:
+                if crawl_queue.complete(job["id"], owner, result):
+                    completed += 1
+                    METRICS.inc("crawl_jobs_total", kind=job["kind"], outcome="done")
+                else:
+                    # The lease ran out and another worker has the job now
+                    METRICS.inc("crawl_jobs_total", kind=job["kind"], outcome="lost")
 
-            if len(recommendations) >= n_recommendations:
-                break
+    with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as executor:
+        return sum(executor.map(work, range(max(n_threads, 1))))
 
-        if len(recommendations) >= n_recommendations:
-            break
+def read_lines(sources, input_path=None):
+    """Return non-empty values from the command line plus one per line of input_path ("-" for stdin)."""
+    values = [value.strip() for value in sources if value.strip()]
+    if input_path:
+        f = sys.stdin if input_path == "-" else open(input_path, encoding="utf-8")
+        try:
+            values.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return values
+
+def read_works(path):
+    """Yield work dicts from an NDJSON file ("-" for stdin), e.g. the output of `crawl`."""
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def iter_collections_works(collection_names, max_workers=4, max_pages=None, base_url=None):
+    """
+    Crawl several collections concurrently and yield (collection_name, work) pairs as soon as
+    any crawler produces them. A collection whose crawl fails is logged and ends early; the
+    others carry on.
+    """
+    results = queue.Queue()
+    done = object()
+
+    def crawl(name):
+        try:
+            for work in get_collection_works(name, max_pages, base_url):
+                results.put((name, work))
+        except Exception:
+            log.exception("Crawl of collection %s failed; its works are incomplete", name)
+        finally:
+            results.put(done)
+
+    executor = ThreadPoolExecutor(max_workers=max(max_workers, 1))
+    try:
+        for name in collection_names:
+            executor.submit(crawl, name)
+        remaining = len(collection_names)
+        while remaining:
+            item = results.get()
+            if item is done:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        executor.shutdown(wait=False)
+
+def write_works(works, out, output_format, context_fields=None):
+    """
+    Write works to out in the given format ("text", "ndjson" or "csv"). context_fields are the CSV
+    context columns, for streams whose first record doesn't carry all of them.
+    """
+    if output_format == "text":
+        print_works(list(works), out=out)
+    elif output_format == "csv":
+        write_csv(works, out, context_fields)
+    else:
+        EXPORTERS[output_format](works, out)
+
+def cmd_crawl(args, out):
+    names = read_lines(args.collections, args.input)
+    works = ({"collection": name, **work}
+             for name, work in iter_collections_works(names, args.concurrency or 4, args.max_collection_pages))
+    if args.users:
+        works = itertools.chain(works, ({"reader": user, **work} for user in args.users
+                                        for work in get_user_bookmarks(user, args.max_collection_pages,
+                                                                       args.concurrency or 8)))
+    if args.cooccurrence:
+        # Count tag co-occurrences as the works stream past; saved when the crawl ends
+        works = load_cooccurrence(args.cooccurrence).track(works)
+    # Collections stream first, so the reader column must be asked for up front
+    write_works(works, out, args.format, ["reader", "collection"] if args.users else None)
+
+def cmd_info(args, out):
+    urls = read_lines(args.urls, args.input)
+    with ThreadPoolExecutor(max_workers=args.concurrency or 4) as executor:
+        # map keeps input order while the fetches overlap
+        works = (info for info in executor.map(extract_work_info, urls) if info)
+        write_works(works, out, args.format)
+
+def cmd_download(args, out):
+    from text_store import TextStore
+    urls = read_lines(args.urls, args.input)
+    store = TextStore(args.store)
+    for url, chapters in download_work_texts(urls, store, args.concurrency or 4, skip_existing=not args.force):
+        out.write(json.dumps({"link": url, "chapters": chapters}) + "\n")
+        out.flush()
+
+def cmd_recommend(args, out):
+    readers = {}
+    if args.works:
+        for work in read_works(args.works):
+            readers.setdefault(work.get("reader") or work.get("collection") or "works", []).append(work)
+    for user in args.users or []:
+        readers[user] = list(get_user_bookmarks(user, args.max_collection_pages, args.concurrency or 8))
+    urls = read_lines(args.urls or [])
+    if urls:
+        with ThreadPoolExecutor(max_workers=args.concurrency or 4) as executor:
+            readers["urls"] = [info for info in executor.map(extract_work_info, urls) if info]
+    names = read_lines(args.collections, args.input)
+    for name, work in iter_collections_works(names, args.concurrency or 4, args.max_collection_pages):
+        readers.setdefault(name, []).append(work)
+    if not readers:
+        print("No works to recommend from.", file=sys.stderr)
+        return 1
+
+    options = dict(n_topics=args.n_topics, n_recommendations=args.n, max_workers=args.concurrency,
+                   max_pages=args.max_pages, config=args.config, canonical_tags=args.canonical_tags,
+                   cooccurrence=load_cooccurrence(args.cooccurrence), n_jobs=args.jobs,
+                   feature_weights={"summary": args.summary_weight})
+    seen = SeenWorks(args.seen) if args.seen else None
+    if len(readers) == 1:
+        reader_works = next(iter(readers.values()))
+        results = [recommend_works_by_tags(reader_works, catalog=args.catalog, seen=seen, **options)]
+    else:
+        # Many readers at once share one model fit and deduplicated searches. They also share the
+        # seen set, which is only added to after every reader has been filtered against it.
+        readers_seen = [seen] * len(readers) if seen is not None else None
+        results = recommend_works_for_users(list(readers.values()), seen=readers_seen, catalog=args.catalog,
+                                            **options)
+    if seen is not None:
+        seen.save()
+
+    records = ({"reader": reader, "rank": rank, **work}
+               for reader, recommendations in zip(readers, results)
+               for rank, work in enumerate(recommendations, 1))
+    write_works(records, out, args.format)
+    return 0
 
-        # Remove the lowest-weighted tag and try again
-        if len(tags_to_try) > 1:
-            tags_to_try = tags_to_try[:-1]
-            print(f"Not enough recommendations found. Trying with fewer tags: {', '.join(tags_to_try)}")
+def cmd_queue(args, out):
+    crawl_queue = CrawlQueue(args.db, wal=not args.no_wal)
+    if args.queue_command == "add":
+        try:
+            jobs = [crawl_job(value) for value in read_lines(args.values, args.input)]
+        except ValueError as exc:
+            print(exc, file=sys.stderr)
+            return 2
+        jobs += [crawl_job(f"/users/{quote(user)}/bookmarks") for user in args.users or []]
+        refresh_before = time.time() if args.refresh else None
+        queued = 0
+        for kind in CRAWL_PRIORITIES:
+            urls = [url for url, job_kind in jobs if job_kind == kind]
+            priority = CRAWL_PRIORITIES[kind] if args.priority is None else args.priority
+            queued += crawl_queue.push_many(urls, kind, priority, refresh_before)
+        log.info("Queued %d new jobs (%d already queued)", queued, len(jobs) - queued)
+    elif args.queue_command == "work":
+        options = dict(n_threads=args.concurrency or 4, rate=args.rate, max_pages=args.max_collection_pages,
+                       wait=args.wait, lease_seconds=args.lease_seconds, wal=not args.no_wal)
+        if args.processes > 1:
+            with ProcessPoolExecutor(max_workers=args.processes) as executor:
+                futures = [executor.submit(crawl_worker, args.db, **options) for _ in range(args.processes)]
+                completed = sum(future.result() for future in futures)
         else:
-            break
+            completed = crawl_worker(args.db, **options)
+        log.info("Completed %d jobs", completed)
+    elif args.queue_command == "status":
+        out.write(json.dumps(crawl_queue.stats()) + "\n")
+    elif args.queue_command == "retry":
+        log.info("Queued %d failed jobs again", crawl_queue.retry_failed())
+    elif args.queue_command == "export":
+        works = (work for _, _, result in crawl_queue.results(args.kind)
+                 for work in (result if isinstance(result, list) else [result]))
+        context_fields = {"work": [], "collection": ["collection"], "bookmarks": ["reader"]}
+        write_works(works, out, args.format, context_fields.get(args.kind, ["reader", "collection"]))
 
-    return recommendations[:n_recommendations]
+def cmd_export(args, out):
+    works = read_works(args.works)
+    if args.scoring:
+        works = top_works(works, args.scoring, args.top)
+    elif args.top is not None:
+        works = (work for _, work in zip(range(args.top), works))
+    write_works(works, out, args.format)
 
-if __name__ == "__main__":
+def interactive(args):
+    """The original prompt-driven flow: ask for a collection or work URLs and print recommendations."""
     choice = input("Do you want to provide a list of work URLs (enter 'list') or a collection name (enter 'collection')? ").strip().lower()
     works_data = []
     if choice == "collection":
@@ -330,15 +1840,189 @@ if __name__ == "__main__":
                     works_data.append(info)
     else:
         print("Invalid choice. Please enter 'list' or 'collection'.")
-        exit(1)
+        return 1
 
     # print_works(works_data)
 
     # Provide recommendations for the list of works
     if works_data:
         recommendations = recommend_works_by_tags(works_data)
-        if recommendations:
+        if recommendations and args.format != "text":
+            EXPORTERS[args.format](top_works(recommendations, args.scoring, args.top), sys.stdout)
+        elif recommendations:
             print("\nRecommended works based on your list:")
-            print_works(recommendations)
+            print_works(recommendations, args.scoring, args.top)
         else:
             print("\nNo recommendations found.")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Recommend AO3 works based on a collection or a list of works. "
+                    "Run without a command for the interactive prompts.")
+    # --scoring, --top and --format may come before or after the subcommand; their defaults are
+    # filled in by output_options so a subcommand's default never overrides a value given up front
+    parser.add_argument("--scoring", choices=sorted(POPULARITY_SCORERS), default=argparse.SUPPRESS,
+                        help="how to order the printed works (default: kudos; only for the prompts and export)")
+    parser.add_argument("--top", type=int, default=argparse.SUPPRESS,
+                        help="only print the N most popular works (only for the prompts and export)")
+    parser.add_argument("--format", choices=["text"] + sorted(EXPORTERS), default=argparse.SUPPRESS,
+                        help="output format (default: text for the prompts, ndjson for subcommands)")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info",
+                        help="progress messages to show on stderr; debug logs every request (default: info)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write request, parse, model-stage and cache metrics as JSON to FILE ('-' for stderr) "
+                             "when the run ends")
+    parser.add_argument("--profile", metavar="STAGES", type=profiling.split_list,
+                        help=f"profile these comma-separated stages ({', '.join(profiling.STAGES)} or 'all'); "
+                             "also settable with $AO3_PROFILE")
+    parser.add_argument("--profile-mode", metavar="MODES", type=profiling.split_list, default=["cpu"],
+                        help="cpu (cProfile hot spots), memory (tracemalloc allocation sites) or cpu,memory "
+                             "(default: cpu)")
+    parser.add_argument("--profile-dir", default="profiles", help="where profile reports are written (default: profiles)")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-i", "--input", help="also read one value per line from this file ('-' for stdin)")
+    common.add_argument("--concurrency", type=int, default=None,
+                        help="concurrent fetches (default: 4 for crawls, one per search for recommendations)")
+    common.add_argument("--cache-dir", help="search cache directory (default: $AO3_CACHE_DIR or ~/.cache/ao3_recommender)")
+    common.add_argument("--no-cache", action="store_true", help="always fetch fresh search results")
+    common.add_argument("--max-collection-pages", type=int, default=None,
+                        help="read at most this many listing pages per collection (or bookmarks pages per user)")
+    common.add_argument("--format", choices=["text"] + sorted(EXPORTERS), default=argparse.SUPPRESS,
+                        help="output format (default: ndjson)")
+
+    commands = parser.add_subparsers(dest="command")
+
+    crawl = commands.add_parser("crawl", parents=[common], help="stream the works of AO3 collections")
+    crawl.add_argument("collections", nargs="*", help="collection names")
+    crawl.add_argument("--users", nargs="+", metavar="USER",
+                       help="also stream the works these AO3 users have bookmarked, with their bookmark tags and notes")
+    crawl.add_argument("--cooccurrence", metavar="DIR",
+                       help="also add the crawled works to the tag co-occurrence matrix in DIR")
+
+    info = commands.add_parser("info", parents=[common], help="fetch details for AO3 work URLs")
+    info.add_argument("urls", nargs="*", help="work URLs")
+
+    download = commands.add_parser("download", parents=[common],
+                                   help="store the full text of AO3 works, compressed, for content features")
+    download.add_argument("urls", nargs="*", help="work URLs")
+    download.add_argument("--store", default=os.path.join(CACHE_DIR, "texts"),
+                          help="text store directory (default: texts under the cache directory)")
+    download.add_argument("--force", action="store_true", help="download works already in the store again")
+
+    recommend = commands.add_parser(
+        "recommend", parents=[common],
+        help="recommend works; each collection (or 'collection'/'reader' group in --works) is one reader")
+    recommend.add_argument("collections", nargs="*", help="collection names")
+    recommend.add_argument("--urls", nargs="+", help="work URLs forming one reading list")
+    recommend.add_argument("--users", nargs="+", metavar="USER",
+                           help="AO3 users whose bookmarks each form one reading list")
+    recommend.add_argument("--works", help="NDJSON works, e.g. from `crawl` ('-' for stdin)")
+    recommend.add_argument("-n", type=int, default=5, help="recommendations per reader (default: 5)")
+    recommend.add_argument("--n-topics", type=int, default=150, help="LDA topics (default: 150)")
+    recommend.add_argument("--max-pages", type=int, default=3, help="result pages read per search (default: 3)")
+    recommend.add_argument("--catalog", help="catalog index directory to draw extra candidates from")
+    recommend.add_argument("--summary-weight", type=float, default=FEATURE_WEIGHTS["summary"],
+                           help="weight of summary similarity against tags when re-ranking; 0 skips hashing "
+                                "summaries (default: %(default)s)")
+    recommend.add_argument("--jobs", type=int, default=1, help="processes hashing summaries (default: 1)")
+    recommend.add_argument("--config", help="tuned settings file written by tune.py (overrides --n-topics)")
+    recommend.add_argument("--seen", metavar="FILE",
+                           help="never recommend the works in FILE, and add the input works and the new "
+                                "recommendations to it (created if missing); with several readers the file is "
+                                "shared, and this run's additions only apply from the next run")
+    recommend.add_argument("--cooccurrence", metavar="DIR",
+                           help="widen short searches with related tags from the co-occurrence matrix in DIR")
+    recommend.add_argument("--canonical-tags", action="store_true",
+                           help="merge tag synonyms into their canonical tags, fetching each tag's page once "
+                                "(cached for a week)")
+
+    queue_parser = commands.add_parser("queue", help="crawl through a durable job queue shared by worker processes")
+    queue_commands = queue_parser.add_subparsers(dest="queue_command", required=True)
+    queue_common = argparse.ArgumentParser(add_help=False)
+    queue_common.add_argument("--db", default=os.path.join(CACHE_DIR, "crawl_queue.sqlite3"),
+                              help="queue database, shared by every worker (default: under the cache directory)")
+    queue_common.add_argument("--no-wal", action="store_true",
+                              help="use SQLite's rollback journal, for a database shared between hosts over a "
+                                   "network filesystem")
+    queue_add = queue_commands.add_parser("add", parents=[common, queue_common],
+                                          help="queue work URLs, collection names or URLs, or bookmarks URLs")
+    queue_add.add_argument("values", nargs="*", help="work URLs, collection names or listing URLs")
+    queue_add.add_argument("--users", nargs="+", metavar="USER", help="also queue these AO3 users' bookmarks")
+    queue_add.add_argument("--priority", type=int, default=None,
+                           help=f"job priority, higher first (default: {PRIORITY_INTERACTIVE} for works and "
+                                f"bookmarks, {PRIORITY_BACKGROUND} for collections)")
+    queue_add.add_argument("--refresh", action="store_true", help="fetch pages that were already fetched again")
+    queue_work = queue_commands.add_parser("work", parents=[common, queue_common],
+                                           help="run queued jobs, --concurrency threads per process")
+    queue_work.add_argument("--processes", type=int, default=1, help="worker processes to start (default: 1)")
+    queue_work.add_argument("--rate", type=float, default=None,
+                            help="at most this many fetches per second across every worker sharing the queue")
+    queue_work.add_argument("--wait", action="store_true", help="keep waiting for new jobs when the queue is empty")
+    queue_work.add_argument("--lease-seconds", type=float, default=300,
+                            help="hand a job to another worker if it isn't finished within this time (default: 300)")
+    queue_commands.add_parser("status", parents=[common, queue_common], help="print job counts by state as JSON")
+    queue_commands.add_parser("retry", parents=[common, queue_common], help="queue failed jobs again")
+    queue_export = queue_commands.add_parser("export", parents=[common, queue_common],
+                                             help="write the works fetched by finished jobs")
+    queue_export.add_argument("--kind", choices=[kind for kind, _ in CRAWL_JOB_KINDS],
+                              help="only jobs of this kind (default: all)")
+
+    export = commands.add_parser("export", parents=[common], help="convert, rank or trim NDJSON works")
+    export.add_argument("works", nargs="?", default="-", help="NDJSON works file (default: stdin)")
+    export.add_argument("--scoring", choices=sorted(POPULARITY_SCORERS), default=argparse.SUPPRESS,
+                        help="order by this popularity score (default: keep input order)")
+    export.add_argument("--top", type=int, default=argparse.SUPPRESS, help="only export the first/top N works")
+    return parser
+
+def output_options(parser, args):
+    """
+    Fill in the defaults of --format, --scoring and --top, which may be given before or after the
+    subcommand, and reject --scoring and --top for subcommands that don't use them.
+    """
+    if args.command not in (None, "export"):
+        given = [f"--{name}" for name in ("scoring", "top") if hasattr(args, name)]
+        if given:
+            parser.error(f"{' and '.join(given)}: only used by the interactive prompts and export")
+    defaults = {"format": "text" if args.command is None else "ndjson",
+                "scoring": "kudos" if args.command is None else None, "top": None}
+    for name, value in defaults.items():
+        if not hasattr(args, name):
+            setattr(args, name, value)
+    return args
+
+COMMANDS = {"crawl": cmd_crawl, "info": cmd_info, "download": cmd_download, "recommend": cmd_recommend,
+            "queue": cmd_queue, "export": cmd_export}
+
+def main(argv=None):
+    parser = build_parser()
+    args = output_options(parser, parser.parse_args(argv))
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(message)s", stream=sys.stderr)
+    if args.profile:
+        try:
+            profiling.configure(args.profile, args.profile_mode, args.profile_dir)
+        except ValueError as exc:
+            build_parser().error(str(exc))
+    try:
+        if args.command is None:
+            return interactive(args)
+
+        if args.no_cache:
+            SEARCH_CACHE.enabled = False
+        elif args.cache_dir:
+            SEARCH_CACHE.use_directory(os.path.join(args.cache_dir, "search"))
+        if args.cache_dir:
+            TAG_CACHE.use_directory(os.path.join(args.cache_dir, "tags"))
+
+        # Progress messages go to stderr so stdout carries only the streamed records
+        out = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            return COMMANDS[args.command](args, out) or 0
+    finally:
+        if args.metrics:
+            with contextlib.redirect_stdout(sys.stderr):
+                METRICS.write_json(args.metrics)
+
+if __name__ == "__main__":
+    sys.exit(main())
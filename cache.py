@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Least-recently-used cache whose entries expire after `ttl` seconds.
+    Entries live in memory (at most max_entries) and, when `directory` is given, are mirrored
+    to one JSON file per key so they survive across runs (at most max_disk_entries files).
+    The directory is only created (and its files counted) on the first write to it.
+    Values must be JSON-serializable. Safe to share between threads.
+    """
+
+    def __init__(self, ttl=900, max_entries=512, directory=None, max_disk_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.use_directory(directory)
+
+    def use_directory(self, directory):
+        """Mirror entries to `directory` from now on (None keeps them in memory only)."""
+        self.directory = directory
+        # Counted on the first write, so setting up a cache never touches the disk
+        self._disk_count = None
+
+    def _ensure_directory(self):
+        with self._lock:
+            if self._disk_count is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._disk_count = sum(1 for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing, expired or the cache is disabled."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._disk_get(key, now) if self.directory else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value, now + self.ttl)
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires)
+        if self.directory:
+            self._disk_set(key, value, expires)
+
+    def _remember(self, key, value, expires):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != key:
+            return None
+        if entry["expires"] <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # Touch the file so disk eviction sees it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["value"]
+
+    def _disk_set(self, key, value, expires):
+        self._ensure_directory()
+        path = self._path(key)
+        is_new = not os.path.exists(path)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "expires": expires, "value": value}, f)
+        os.replace(tmp_path, path)
+        if is_new:
+            with self._lock:
+                self._disk_count += 1
+                evict = self._disk_count > self.max_disk_entries
+            if evict:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """
+        Remove expired files, then the least recently used ones, down to 90% of max_disk_entries.
+        Expiry is read from each file's stored "expires"; the mtime (touched on every read) only
+        orders the survivors by last use.
+        """
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+                with open(entry.path, encoding="utf-8") as f:
+                    expires = json.load(f)["expires"]
+            except (OSError, ValueError, KeyError, TypeError):
+                expires = 0
+            if expires <= now:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            files.append((mtime, entry.path))
+        files.sort()
+        target = int(self.max_disk_entries * 0.9)
+        remaining = len(files)
+        for _, path in files[:max(remaining - target, 0)]:
+            try:
+                os.remove(path)
+                remaining -= 1
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_count = remaining
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.directory and os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.endswith(".json"):
+                        os.remove(os.path.join(self.directory, name))
+                self._disk_count = 0
@@ -0,0 +1,228 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Work pages someone is waiting on are leased before background listing refreshes
+PRIORITY_INTERACTIVE = 100
+PRIORITY_BACKGROUND = 0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL,
+    queued REAL NOT NULL,
+    finished REAL,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, priority DESC, id);
+CREATE INDEX IF NOT EXISTS jobs_leases ON jobs (state, lease_until);
+CREATE TABLE IF NOT EXISTS throttle (name TEXT PRIMARY KEY, next_at REAL NOT NULL);
+"""
+
+JOB_COLUMNS = ("id", "url", "kind", "priority", "attempts", "queued")
+
+
+class CrawlQueue:
+    """
+    Durable queue of URLs to fetch, kept in the SQLite database at `path` and shared by any number
+    of worker threads and processes.
+
+    Each URL is queued once (pushing it again only raises its priority). Workers lease the ready
+    jobs with the highest priority for lease_seconds; a job whose worker dies is leased again
+    once its lease runs out. A failed job is retried with exponential backoff until it has been
+    tried max_attempts times. Results are stored with the finished job.
+
+    Every claim is one short write transaction, so contention stays far below any polite fetch
+    rate. The database uses WAL mode by default, which needs every process on one host; for a
+    file shared between hosts over a network filesystem pass wal=False to use SQLite's rollback
+    journal and the filesystem's locks instead.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=5, backoff=30.0, wal=True):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.wal = wal
+        self._local = threading.local()
+        self._connection()
+
+    def _connection(self):
+        """This thread's connection (SQLite connections can't be shared between threads)."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit, with explicit BEGIN IMMEDIATE where a read must not race a write
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA busy_timeout = 60000")
+            if self.wal:
+                connection.execute("PRAGMA journal_mode = WAL")
+                connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        return _Transaction(connection)
+
+    def push(self, url, kind, priority=PRIORITY_BACKGROUND, refresh_before=None):
+        """
+        Queue url as a job of `kind`. A URL already queued keeps its place, but takes the higher
+        of the two priorities; a finished one is only queued again when it finished before the
+        refresh_before timestamp. Returns True if the job was (re)queued.
+        """
+        return self.push_many([url], kind, priority, refresh_before) == 1
+
+    def push_many(self, urls, kind, priority=PRIORITY_BACKGROUND, refresh_before=None):
+        """push every URL in one transaction; returns how many were (re)queued."""
+        now = time.time()
+        queued = 0
+        with self._transaction() as connection:
+            for url in urls:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO jobs (url, kind, priority, queued) VALUES (?, ?, ?, ?)",
+                    (url, kind, priority, now))
+                if cursor.rowcount:
+                    queued += 1
+                    continue
+                connection.execute("UPDATE jobs SET priority = ? WHERE url = ? AND priority < ?",
+                                   (priority, url, priority))
+                if refresh_before is not None:
+                    cursor = connection.execute(
+                        "UPDATE jobs SET state = 'pending', attempts = 0, not_before = 0, error = NULL, queued = ?"
+                        " WHERE url = ? AND state IN ('done', 'failed') AND finished < ?",
+                        (now, url, refresh_before))
+                    queued += cursor.rowcount
+        return queued
+
+    def lease(self, owner, n=1):
+        """
+        Claim up to n ready jobs for `owner`, highest priority first (oldest first within a
+        priority), as dicts with "id", "url", "kind", "priority", "attempts" and "queued".
+        Expired leases are reclaimed first. Returns [] when no job is ready.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            self._reclaim(connection, now)
+            rows = connection.execute(
+                "SELECT id, url, kind, priority, attempts, queued FROM jobs"
+                " WHERE state = 'pending' AND not_before <= ? ORDER BY priority DESC, id LIMIT ?",
+                (now, n)).fetchall()
+            connection.executemany(
+                "UPDATE jobs SET state = 'leased', lease_owner = ?, lease_until = ?, attempts = attempts + 1"
+                " WHERE id = ?", [(owner, now + self.lease_seconds, row["id"]) for row in rows])
+        return [{**dict(zip(JOB_COLUMNS, row)), "attempts": row["attempts"] + 1} for row in rows]
+
+    def _reclaim(self, connection, now):
+        connection.execute(
+            "UPDATE jobs SET state = 'failed', lease_owner = NULL, finished = ?, error = 'lease expired'"
+            " WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, self.max_attempts))
+        connection.execute(
+            "UPDATE jobs SET state = 'pending', lease_owner = NULL WHERE state = 'leased' AND lease_until < ?",
+            (now,))
+
+    def complete(self, job_id, owner, result=None):
+        """
+        Mark a leased job done, storing its JSON-serializable result. Returns False (and stores
+        nothing) if owner's lease ran out and the job was handed to another worker meanwhile.
+        """
+        cursor = self._connection().execute(
+            "UPDATE jobs SET state = 'done', lease_owner = NULL, finished = ?, error = NULL, result = ?"
+            " WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+            (time.time(), None if result is None else json.dumps(result), job_id, owner))
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, owner, error, retry_after=None, permanent=False):
+        """
+        Record a failed attempt at a leased job. It is retried after retry_after seconds (default
+        backoff * 2 ** (attempts - 1)) unless it is permanent or out of attempts, when it is
+        marked failed. Returns False if owner no longer holds the lease.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT attempts FROM jobs WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                                     (job_id, owner)).fetchone()
+            if row is None:
+                return False
+            if permanent or row["attempts"] >= self.max_attempts:
+                connection.execute("UPDATE jobs SET state = 'failed', lease_owner = NULL, finished = ?, error = ?"
+                                   " WHERE id = ?", (now, error, job_id))
+            else:
+                delay = retry_after if retry_after is not None else self.backoff * 2 ** (row["attempts"] - 1)
+                connection.execute("UPDATE jobs SET state = 'pending', lease_owner = NULL, not_before = ?, error = ?"
+                                   " WHERE id = ?", (now + delay, error, job_id))
+        return True
+
+    def retry_failed(self):
+        """Queue every failed job again with fresh attempts; returns how many."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET state = 'pending', attempts = 0, not_before = 0, queued = ? WHERE state = 'failed'",
+            (time.time(),))
+        return cursor.rowcount
+
+    def throttle(self, name, interval):
+        """
+        Reserve the next fetch slot of the shared rate limit `name`, which allows one fetch per
+        interval seconds across every worker using the database, and return how many seconds
+        to wait for it.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT next_at FROM throttle WHERE name = ?", (name,)).fetchone()
+            slot = max(now, row["next_at"] if row else now)
+            connection.execute("INSERT OR REPLACE INTO throttle (name, next_at) VALUES (?, ?)", (name, slot + interval))
+        return slot - now
+
+    def stats(self):
+        """Job counts by state, plus how many pending jobs are "ready" to lease now."""
+        connection = self._connection()
+        counts = {state: 0 for state in ("pending", "leased", "done", "failed")}
+        counts.update(connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        counts["ready"] = connection.execute("SELECT COUNT(*) FROM jobs WHERE state = 'pending' AND not_before <= ?",
+                                             (time.time(),)).fetchone()[0]
+        return counts
+
+    def drained(self):
+        """True when no job is pending or leased, so no worker can queue more."""
+        return self._connection().execute(
+            "SELECT 1 FROM jobs WHERE state IN ('pending', 'leased') LIMIT 1").fetchone() is None
+
+    def results(self, kind=None):
+        """Yield (url, kind, result) for every finished job with a result, in the order they were queued."""
+        query = "SELECT url, kind, result FROM jobs WHERE state = 'done' AND result IS NOT NULL"
+        parameters = ()
+        if kind is not None:
+            query += " AND kind = ?"
+            parameters = (kind,)
+        for url, kind_, result in self._connection().execute(query + " ORDER BY id", parameters):
+            yield url, kind_, json.loads(result)
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class _Transaction:
+    """Commits on a clean exit and rolls back on an error."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type is not None else "COMMIT")
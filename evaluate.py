@@ -0,0 +1,197 @@
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bookmarks
+
+# Engine configurations compared by default: the LSH index alone at increasing probe counts,
+# and index candidates re-ranked against the reader's full profile
+DEFAULT_CONFIGS = [
+    {"name": "index-p1", "engine": "index", "n_probes": 1},
+    {"name": "index-p2", "engine": "index", "n_probes": 2},
+    {"name": "index-p4", "engine": "index", "n_probes": 4},
+    {"name": "rerank", "engine": "rerank", "n_probes": 2, "pool_size": 100},
+    {"name": "rerank-tags-only", "engine": "rerank", "n_probes": 2, "pool_size": 100,
+     "feature_weights": {"summary": 0}},
+]
+
+
+def recommend_index(works, catalog, k, config):
+    """The catalog works nearest to the reading list's topic mixture."""
+    return bookmarks.recommend_works_from_index(works, catalog, k, config.get("n_probes", 2),
+                                                config.get("max_candidates"))
+
+
+def recommend_rerank(works, catalog, k, config):
+    """A pool of nearest catalog works, re-ranked like online recommendations."""
+    pool_size = max(config.get("pool_size", 100), k)
+    candidates = bookmarks.recommend_works_from_index(works, catalog, pool_size, config.get("n_probes", 2),
+                                                      config.get("max_candidates"))
+    profile = bookmarks.build_tag_profile(works, models=catalog, feature_weights=config.get("feature_weights"))
+    if profile is None:
+        return []
+    return bookmarks.rerank_candidates(candidates, profile, k, config.get("weights"), config.get("feature_weights"))
+
+
+# Offline engines: each recommends from the stored catalog only, without any network requests
+ENGINES = {"index": recommend_index, "rerank": recommend_rerank}
+
+_catalog = None
+_lists = None
+
+
+def _init_worker(index_dir, lists):
+    global _catalog, _lists
+    _catalog = bookmarks.load_catalog_index(index_dir)
+    _lists = lists
+
+
+def run_fold(task):
+    """Recommend for one reading list with one work held out; returns (config, list, held-out link, links, seconds)."""
+    config_index, config, list_index, held_out, k = task
+    works = _lists[list_index]
+    remaining = works[:held_out] + works[held_out + 1:]
+    start = time.perf_counter()
+    recommendations = ENGINES[config["engine"]](remaining, _catalog, k, config)
+    seconds = time.perf_counter() - start
+    return config_index, list_index, works[held_out]["link"], [work["link"] for work in recommendations], seconds
+
+
+def group_lists(works, min_size=2):
+    """Group works into reading lists by their "reader" or "collection" field, as `bookmarks.py recommend` does."""
+    lists = {}
+    for work in works:
+        lists.setdefault(work.get("reader") or work.get("collection") or "works", []).append(work)
+    return {name: items for name, items in lists.items() if len(items) >= min_size}
+
+
+def make_folds(lists, catalog_links, max_folds_per_list=None, seed=42):
+    """(list index, held-out position) pairs for every held-out work the catalog could recommend."""
+    rng = random.Random(seed)
+    folds = []
+    for list_index, works in enumerate(lists):
+        positions = [i for i, work in enumerate(works) if work["link"] in catalog_links]
+        if max_folds_per_list is not None and len(positions) > max_folds_per_list:
+            positions = sorted(rng.sample(positions, max_folds_per_list))
+        folds.extend((list_index, position) for position in positions)
+    return folds
+
+
+def score(results, ks, catalog_size):
+    """Recall@k, nDCG@k, catalog coverage and latency for one configuration's fold results."""
+    report = {"folds": len(results)}
+    for k in ks:
+        hits = 0
+        gain = 0.0
+        for held_out, links, _ in results:
+            top = links[:k]
+            if held_out in top:
+                hits += 1
+                # One relevant work per fold, so the ideal DCG is 1
+                gain += 1.0 / math.log2(top.index(held_out) + 2)
+        report[f"recall@{k}"] = hits / len(results) if results else 0.0
+        report[f"ndcg@{k}"] = gain / len(results) if results else 0.0
+    recommended = {link for _, links, _ in results for link in links[:max(ks)]}
+    report["coverage"] = len(recommended) / catalog_size if catalog_size else 0.0
+    timings = sorted(seconds for _, _, seconds in results)
+    if timings:
+        report["latency_ms"] = {
+            "mean": 1000 * statistics.fmean(timings),
+            "p50": 1000 * timings[len(timings) // 2],
+            "p95": 1000 * timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        }
+    return report
+
+
+def evaluate(index_dir, lists=None, configs=None, ks=(5, 10, 20), n_jobs=None, max_folds_per_list=None,
+             min_list_size=2, seed=42):
+    """
+    Leave-one-out evaluation of each engine configuration against a catalog index built by
+    bookmarks.build_catalog_index. Every reading list (by default, the catalog's works grouped by
+    collection) is recommended for once per held-out work, with the rest of the list as input;
+    a fold is a hit when the held-out work is in the top k. Folds run across n_jobs processes.
+    Returns one report per configuration with quality and latency side by side.
+    """
+    configs = configs or DEFAULT_CONFIGS
+    catalog = bookmarks.load_catalog_index(index_dir)
+    catalog_links = {work["link"] for work in catalog["works"]}
+    lists = list(group_lists(lists if lists is not None else catalog["works"], min_list_size).values())
+    folds = make_folds(lists, catalog_links, max_folds_per_list, seed)
+    k = max(ks)
+    tasks = [(c, config, list_index, held_out, k)
+             for c, config in enumerate(configs) for list_index, held_out in folds]
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(index_dir, lists)) as executor:
+            outcomes = list(executor.map(run_fold, tasks, chunksize=max(len(tasks) // (n_jobs * 4), 1)))
+    else:
+        _init_worker(index_dir, lists)
+        outcomes = [run_fold(task) for task in tasks]
+
+    results = [[] for _ in configs]
+    for config_index, _, held_out, links, seconds in outcomes:
+        results[config_index].append((held_out, links, seconds))
+    return {
+        "catalog": index_dir,
+        "catalog_size": len(catalog["works"]),
+        "reading_lists": len(lists),
+        "workers": n_jobs,
+        "configs": [{**config, **score(config_results, ks, len(catalog["works"]))}
+                    for config, config_results in zip(configs, results)],
+    }
+
+
+def format_table(report, ks):
+    columns = [f"recall@{k}" for k in ks] + [f"ndcg@{k}" for k in ks] + ["coverage"]
+    lines = [f"{'config':<20}{'folds':>7}" + "".join(f"{column:>11}" for column in columns)
+             + f"{'p50 ms':>9}{'p95 ms':>9}"]
+    for config in report["configs"]:
+        latency = config.get("latency_ms", {})
+        lines.append(f"{config['name']:<20}{config['folds']:>7}"
+                     + "".join(f"{config[column]:>11.3f}" for column in columns)
+                     + f"{latency.get('p50', 0):>9.1f}{latency.get('p95', 0):>9.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Leave-one-out evaluation of recommendation engines on a stored catalog.")
+    parser.add_argument("catalog", help="catalog index directory (built with --build or bookmarks.build_catalog_index)")
+    parser.add_argument("--build", metavar="WORKS",
+                        help="first build the catalog index from this NDJSON works file "
+                             "(e.g. `bookmarks.py crawl` output)")
+    parser.add_argument("--n-topics", type=int, default=150, help="topics when building the index (default: 150)")
+    parser.add_argument("--lists", help="NDJSON reading lists grouped by 'reader' or 'collection' "
+                                        "(default: the catalog's own collections)")
+    parser.add_argument("--configs", help="JSON file with a list of engine configurations (default: built-in set)")
+    parser.add_argument("-k", type=int, nargs="+", default=[5, 10, 20], help="cutoffs for recall and nDCG")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--max-folds-per-list", type=int, default=None,
+                        help="hold out at most this many works per list")
+    parser.add_argument("--format", choices=["json", "table"], default="json")
+    args = parser.parse_args()
+
+    if args.build:
+        bookmarks.build_catalog_index(bookmarks.read_works(args.build), args.catalog, n_topics=args.n_topics)
+    configs = None
+    if args.configs:
+        with open(args.configs, encoding="utf-8") as f:
+            configs = json.load(f)
+        unknown = sorted({config.get("engine") for config in configs} - set(ENGINES), key=str)
+        if unknown:
+            parser.error(f"unknown engine(s): {', '.join(map(str, unknown))}; choose from {', '.join(ENGINES)}")
+    lists = list(bookmarks.read_works(args.lists)) if args.lists else None
+    report = evaluate(args.catalog, lists, configs, sorted(args.k), args.jobs, args.max_folds_per_list)
+    if args.format == "table":
+        print(format_table(report, sorted(args.k)))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,189 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds (in seconds for timers), the same defaults as Prometheus client libraries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, histograms and gauges, each series identified by a name and
+    keyword labels (e.g. host="archiveofourown.gay"). Gauges are functions read when the metrics are
+    exported. snapshot() returns everything as a JSON-serializable dict and to_prometheus() in the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self, prefix="ao3_"):
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._buckets = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_buckets(self, name, buckets):
+        """Use these bucket upper bounds for a histogram instead of DEFAULT_BUCKETS."""
+        with self._lock:
+            self._buckets[name] = tuple(sorted(buckets))
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+                entry = series[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(entry["buckets"]):
+                if value <= bound:
+                    entry["counts"][i] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the seconds spent in the `with` block in a histogram, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge(self, name, fn, **labels):
+        """Report fn() as the value of a gauge whenever the metrics are exported."""
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = fn
+
+    def value(self, name, **labels):
+        """Current value of a counter (0 if it was never incremented)."""
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def reset(self):
+        """Forget all counter and histogram observations; gauges stay registered."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _read(self):
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: {**entry, "counts": list(entry["counts"])} for key, entry in series.items()}
+                          for name, series in self._histograms.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+        gauge_values = {}
+        for name, series in gauges.items():
+            gauge_values[name] = {}
+            for key, fn in series.items():
+                try:
+                    gauge_values[name][key] = fn()
+                except Exception:
+                    gauge_values[name][key] = math.nan
+        return counters, histograms, gauge_values
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict."""
+        counters, histograms, gauges = self._read()
+
+        def series_list(series, render):
+            return [{"labels": dict(key), **render(value)} for key, value in sorted(series.items())]
+
+        def render_histogram(entry):
+            cumulative, buckets = 0, {}
+            for bound, count in zip(entry["buckets"], entry["counts"]):
+                cumulative += count
+                buckets[_format_value(bound)] = cumulative
+            return {
+                "count": entry["count"],
+                "sum": entry["sum"],
+                "mean": entry["sum"] / entry["count"] if entry["count"] else 0.0,
+                "buckets": buckets,
+            }
+
+        return {
+            "counters": {name: series_list(series, lambda value: {"value": value})
+                         for name, series in sorted(counters.items())},
+            "histograms": {name: series_list(series, render_histogram)
+                           for name, series in sorted(histograms.items())},
+            "gauges": {name: series_list(series, lambda value: {"value": value})
+                       for name, series in sorted(gauges.items())},
+        }
+
+    def write_json(self, path):
+        """Write snapshot() to path ("-" for stdout)."""
+        data = json.dumps(self.snapshot(), indent=2)
+        if path == "-":
+            print(data)
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+
+    def to_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        counters, histograms, gauges = self._read()
+        lines = []
+        for name, series in sorted(counters.items()):
+            name = self.prefix + name
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        for name, series in sorted(histograms.items()):
+            name = self.prefix + name
+            lines.append(f"# TYPE {name} histogram")
+            for key, entry in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(entry["buckets"], entry["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {entry['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(entry['sum'])}")
+                lines.append(f"{name}_count{_format_labels(key)} {entry['count']}")
+        for name, series in sorted(gauges.items()):
+            name = self.prefix + name
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by the scraper, the recommender and the server
+METRICS = Metrics()
@@ -0,0 +1,215 @@
+import atexit
+import contextlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+# Stages that can be profiled; bookmarks.py wraps each of them in stage(name)
+STAGES = ("crawl", "parse", "vectorize", "lda_fit", "lda_transform", "search", "rerank")
+MODES = ("cpu", "memory")
+
+# Rows in each hot-spot / allocation report
+REPORT_LINES = 40
+
+# Entries per stage whose allocations are recorded; tracemalloc snapshots are slow and large,
+# so a stage entered once per page is sampled rather than snapshotted every time
+MEMORY_SAMPLES = 3
+
+_NULL = contextlib.nullcontext()
+_enabled = frozenset()
+_profiler = None
+
+
+class StageProfiler:
+    """
+    Profile the chosen stages with cProfile ("cpu") and/or tracemalloc ("memory") and write
+    one report per stage to `directory` when the process exits.
+
+    cProfile follows a single thread, so every entry into a stage gets its own profiler, and the
+    results for a stage are merged across threads and calls. When stages nest (parse inside crawl)
+    the inner stage's time is reported under the inner stage only. For allocations, tracemalloc's
+    traces are cleared on entering a stage, so the snapshot taken on leaving it holds exactly the
+    blocks allocated meanwhile and still alive, plus the peak traced size. Tracing is process-wide:
+    stages running concurrently in other threads show up in each other's allocations. Only the
+    first MEMORY_SAMPLES entries of each stage are recorded.
+    """
+
+    def __init__(self, stages, modes=("cpu",), directory="profiles"):
+        self.stages = frozenset(stages)
+        self.modes = frozenset(modes)
+        self.directory = directory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._calls = Counter()
+        self._seconds = Counter()
+        self._skipped = Counter()
+        self._allocations = {}
+        self._peaks = Counter()
+        self._memory_samples = Counter()
+        if "memory" in self.modes:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        outer = stack[-1] if stack else None
+        if outer is not None:
+            outer.disable()
+        sampled = self._start_memory(name) if "memory" in self.modes else False
+        profile = self._start_cpu(name) if "cpu" in self.modes else None
+        stack.append(profile or _NoProfile)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if profile is not None:
+                profile.disable()
+            if sampled:
+                self._finish_memory(name)
+            with self._lock:
+                self._calls[name] += 1
+                self._seconds[name] += elapsed
+                if profile is not None:
+                    import pstats
+                    if name in self._stats:
+                        self._stats[name].add(profile)
+                    else:
+                        self._stats[name] = pstats.Stats(profile)
+            if outer is not None:
+                outer.enable()
+
+    def _start_cpu(self, name):
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Only one cProfile may be active at a time on Python 3.12+; skip overlapping entries
+            with self._lock:
+                self._skipped[name] += 1
+            return None
+        return profile
+
+    def _start_memory(self, name):
+        import tracemalloc
+        with self._lock:
+            if self._memory_samples[name] >= MEMORY_SAMPLES:
+                return False
+            self._memory_samples[name] += 1
+        # Diffing against a snapshot of the whole heap takes seconds; starting from empty traces doesn't
+        tracemalloc.clear_traces()
+        return True
+
+    def _finish_memory(self, name):
+        import tracemalloc
+        peak = tracemalloc.get_traced_memory()[1]
+        stats = tracemalloc.take_snapshot().statistics("lineno")
+        with self._lock:
+            sites = self._allocations.setdefault(name, {})
+            for stat in stats:
+                frame = stat.traceback[0]
+                if frame.filename in (tracemalloc.__file__, __file__):
+                    continue
+                size, count = sites.get((frame.filename, frame.lineno), (0, 0))
+                sites[(frame.filename, frame.lineno)] = (size + stat.size, count + stat.count)
+            self._peaks[name] = max(self._peaks[name], peak)
+
+    def dump(self):
+        """Write <stage>.prof (pstats data) plus <stage>.cpu.txt and/or <stage>.memory.txt reports."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            for name, stats in self._stats.items():
+                stats.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+                report = io.StringIO()
+                report.write(f"{name}: {self._calls[name]} calls, {self._seconds[name]:.3f}s wall")
+                if self._skipped[name]:
+                    report.write(f", {self._skipped[name]} overlapping calls not profiled")
+                report.write("\n")
+                stats.stream = report
+                stats.sort_stats("cumulative").print_stats(REPORT_LINES)
+                report.write("\n")
+                stats.sort_stats("tottime").print_stats(REPORT_LINES)
+                with open(os.path.join(self.directory, f"{name}.cpu.txt"), "w", encoding="utf-8") as f:
+                    f.write(report.getvalue())
+            for name, sites in self._allocations.items():
+                top = sorted(sites.items(), key=lambda item: item[1][0], reverse=True)[:REPORT_LINES]
+                with open(os.path.join(self.directory, f"{name}.memory.txt"), "w", encoding="utf-8") as f:
+                    f.write(f"{name}: {self._memory_samples[name]} of {self._calls[name]} calls sampled, "
+                            f"peak {self._peaks[name] / 1024:.1f} KiB traced during a call\n")
+                    f.write("Allocations made inside the stage and still alive when it returned:\n")
+                    f.write(f"{'KiB':>12} {'blocks':>10}  allocation site\n")
+                    for (filename, lineno), (size, count) in top:
+                        f.write(f"{size / 1024:12.1f} {count:10d}  {filename}:{lineno}\n")
+
+
+class _NoProfile:
+    """Stand-in on the stage stack when a stage is entered without a CPU profiler."""
+
+    @staticmethod
+    def enable():
+        pass
+
+    @staticmethod
+    def disable():
+        pass
+
+
+def stage(name):
+    """
+    Context manager around one run of a named stage. Returns a shared no-op context unless
+    the stage is being profiled, so disabled profiling costs one set lookup.
+    """
+    if name not in _enabled:
+        return _NULL
+    return _profiler.stage(name)
+
+
+def configure(stages, modes=("cpu",), directory="profiles"):
+    """
+    Profile the given stages (names from STAGES, or "all") in the given modes from now on;
+    reports are written to directory when the process exits.
+    """
+    global _enabled, _profiler
+    stages = set(STAGES) if "all" in stages else set(stages)
+    unknown = stages.difference(STAGES) | set(modes).difference(MODES)
+    if unknown:
+        raise ValueError(f"Unknown profiling stages or modes: {', '.join(sorted(unknown))}")
+    if not stages:
+        return
+    first = _profiler is None
+    _profiler = StageProfiler(stages, modes, directory)
+    _enabled = _profiler.stages
+    if first:
+        atexit.register(lambda: _profiler.dump())
+
+
+def split_list(value):
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def configure_from_environment():
+    """
+    Apply AO3_PROFILE=crawl,parse (or "all"), which enables profiling without touching the command
+    line; AO3_PROFILE_MODE=cpu,memory and AO3_PROFILE_DIR choose what is recorded and where.
+    Bad values are logged and ignored, since this runs on import.
+    """
+    if not os.environ.get("AO3_PROFILE"):
+        return
+    try:
+        configure(split_list(os.environ["AO3_PROFILE"]), split_list(os.environ.get("AO3_PROFILE_MODE", "cpu")),
+                  os.environ.get("AO3_PROFILE_DIR", "profiles"))
+    except ValueError as exc:
+        logging.getLogger("bookmarks").warning("Ignoring AO3_PROFILE: %s", exc)
+
+
+configure_from_environment()
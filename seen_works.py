@@ -0,0 +1,80 @@
+import array
+import bisect
+import os
+import re
+import sys
+
+WORK_ID = re.compile(r"/works/(\d+)")
+
+
+def work_id(link):
+    """The AO3 work id in a work link, or None."""
+    match = WORK_ID.search(link or "")
+    return int(match.group(1)) if match else None
+
+
+class SeenWorks:
+    """
+    Exact set of the AO3 work ids a reader has already read or been recommended, persisted across
+    sessions as a sorted array of uint32 ids: 4 bytes per work, so 50,000 seen works take 200 KB
+    on disk and in memory. Lookups bisect the sorted array (about 16 steps for 50,000 works) or
+    hit the small set of ids added since it was last saved. Not safe to share between threads
+    while being added to.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._ids = array.array("I")
+        self._added = set()
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                self._ids.frombytes(f.read())
+            if sys.byteorder != "little":
+                self._ids.byteswap()
+
+    def __len__(self):
+        return len(self._ids) + len(self._added)
+
+    def __contains__(self, work_id):
+        if not isinstance(work_id, int):
+            return False
+        if work_id in self._added:
+            return True
+        i = bisect.bisect_left(self._ids, work_id)
+        return i < len(self._ids) and self._ids[i] == work_id
+
+    def add(self, work_id):
+        if work_id not in self:
+            self._added.add(work_id)
+
+    def add_works(self, works):
+        """Mark works (dicts with a "link") as seen."""
+        for work in works:
+            work_id_ = work_id(work.get("link"))
+            if work_id_ is not None:
+                self.add(work_id_)
+
+    def seen_link(self, link):
+        work_id_ = work_id(link)
+        return work_id_ is not None and work_id_ in self
+
+    def compact(self):
+        """Merge the ids added since the last save into the sorted array."""
+        if self._added:
+            self._ids = array.array("I", sorted(set(self._ids).union(self._added)))
+            self._added = set()
+
+    def save(self, path=None):
+        """Write the sorted ids (little-endian uint32) to path, default the file the set was loaded from."""
+        path = path or self.path
+        self.compact()
+        ids = self._ids
+        if sys.byteorder != "little":
+            ids = array.array("I", ids)
+            ids.byteswap()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Replace the file atomically so a crash never leaves a truncated set behind
+        with open(path + ".tmp", "wb") as f:
+            ids.tofile(f)
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,247 @@
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bookmarks
+from metrics import METRICS
+
+
+class MicroBatcher:
+    """
+    Run items submitted from many threads through `handler` in batches. The first item of a batch
+    waits at most `window` seconds for others to arrive (up to max_batch items); handler receives
+    the list of items and must return one result per item. If a batch fails, its items are run
+    one at a time so only the item that caused the error gets it.
+    """
+
+    def __init__(self, handler, window=0.005, max_batch=32):
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.batched_items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue an item and return a Future for its result."""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.batches += 1
+            self.batched_items += len(batch)
+            items = [item for item, _ in batch]
+            try:
+                results = self.handler(items)
+            except Exception as exc:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(exc)
+                else:
+                    self._run_each(batch)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _run_each(self, batch):
+        for item, future in batch:
+            try:
+                future.set_result(self.handler([item])[0])
+            except Exception as exc:
+                future.set_exception(exc)
+
+
+class RecommendationService:
+    """
+    Keeps everything a recommendation needs warm between requests: the fitted vectorizer and
+    topic model, the search cache and the HTTP connection pool. The models come from a catalog
+    index, or are fitted once at startup with n_topics topics on `works` (e.g. a crawled NDJSON
+    catalog); refitting them for every batch would take seconds per request.
+    Concurrent requests are micro-batched into one recommend_works_for_users call.
+    """
+
+    def __init__(self, catalog=None, n_topics=150, window=0.005, max_batch=32, works=None):
+        self.n_topics = n_topics
+        if catalog:
+            self.models = bookmarks.load_catalog_index(catalog)
+        elif works is not None:
+            profile = bookmarks.build_tag_profile(list(works), n_topics)
+            if profile is None:
+                raise ValueError("No tagged works to fit the models on.")
+            self.models = {"vectorizer": profile["vectorizer"], "lda": profile["lda"]}
+        else:
+            raise ValueError("A catalog index or works to fit the models on are required.")
+        self.batcher = MicroBatcher(self._recommend_batch, window, max_batch)
+        self.started = time.time()
+        METRICS.gauge("server_uptime_seconds", lambda: time.time() - self.started)
+        METRICS.gauge("server_batches", lambda: self.batcher.batches)
+        METRICS.gauge("server_batched_requests", lambda: self.batcher.batched_items)
+        METRICS.gauge("server_warm_models", lambda: self.models is not None)
+
+    def resolve_works(self, payload):
+        """Return the reader's works from a request: inline works, work URLs or a collection name."""
+        if "works" in payload:
+            return payload["works"]
+        if "urls" in payload:
+            works = []
+            for url in payload["urls"]:
+                info = bookmarks.extract_work_info(url.strip())
+                if info:
+                    works.append(info)
+            return works
+        if "collection" in payload:
+            return list(bookmarks.get_collection_works(payload["collection"]))
+        raise ValueError("Request must contain 'works', 'urls' or 'collection'.")
+
+    def check_request(self, works, n_recommendations):
+        """Raise ValueError for a request that would fail the batch it joins."""
+        if not isinstance(works, list) or not works:
+            raise ValueError("No works to recommend from.")
+        for work in works:
+            if not isinstance(work, dict) or not isinstance(work.get("link"), str) \
+                    or not isinstance(work.get("tags"), list):
+                raise ValueError("Every work must be an object with a 'link' and a list of 'tags'.")
+        if isinstance(n_recommendations, bool) or not isinstance(n_recommendations, int) or n_recommendations < 1:
+            raise ValueError("'n' must be a positive integer.")
+
+    def _recommend_batch(self, items):
+        n_recommendations = max(n for _, n in items)
+        results = bookmarks.recommend_works_for_users(
+            [works for works, _ in items], n_topics=self.n_topics,
+            n_recommendations=n_recommendations, models=self.models,
+        )
+        return [recommendations[:n] for recommendations, (_, n) in zip(results, items)]
+
+    def recommend(self, payload):
+        METRICS.inc("server_requests_total")
+        try:
+            with METRICS.timer("server_request_seconds"):
+                works = self.resolve_works(payload)
+                n_recommendations = payload.get("n", 5)
+                self.check_request(works, n_recommendations)
+                return self.batcher.submit((works, n_recommendations)).result()
+        except Exception:
+            METRICS.inc("server_errors_total")
+            raise
+
+    def metrics(self):
+        requests = METRICS.value("server_requests_total")
+        errors = METRICS.value("server_errors_total")
+        latency = METRICS.snapshot()["histograms"].get("server_request_seconds", [])
+        latency_total = latency[0]["sum"] if latency else 0.0
+        cache = bookmarks.SEARCH_CACHE
+        lookups = cache.hits + cache.misses
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "requests": requests,
+            "errors": errors,
+            "mean_latency_seconds": latency_total / requests if requests else 0.0,
+            "batches": self.batcher.batches,
+            "mean_batch_size": self.batcher.batched_items / self.batcher.batches if self.batcher.batches else 0.0,
+            "search_cache_hits": cache.hits,
+            "search_cache_misses": cache.misses,
+            "search_cache_hit_ratio": cache.hits / lookups if lookups else 0.0,
+            "warm_models": self.models is not None,
+            "stages": METRICS.snapshot(),
+        }
+
+
+def make_handler(service):
+    class RecommendationHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, data, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_json(self, status, body):
+            self._send(status, json.dumps(body).encode("utf-8"), "application/json")
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                self._send(200, METRICS.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+            elif self.path == "/metrics.json":
+                self._send_json(200, service.metrics())
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/recommend":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(payload, dict):
+                    raise ValueError("Request body must be a JSON object.")
+            except ValueError as exc:
+                self._send_json(400, {"error": str(exc)})
+                return
+            try:
+                recommendations = service.recommend(payload)
+            except ValueError as exc:
+                self._send_json(400, {"error": str(exc)})
+                return
+            except Exception as exc:
+                self._send_json(500, {"error": str(exc)})
+                return
+            self._send_json(200, {"recommendations": recommendations})
+
+    return RecommendationHandler
+
+
+def serve(host="127.0.0.1", port=8080, catalog=None, n_topics=150, window=0.005, max_batch=32, works=None):
+    """Run the recommendation server until interrupted."""
+    service = RecommendationService(catalog, n_topics, window, max_batch, works)
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving recommendations on http://{host}:{port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve AO3 recommendations over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--catalog", help="catalog index directory whose fitted models are kept warm")
+    parser.add_argument("--works", help="NDJSON works, e.g. from `crawl`, to fit the models on at startup "
+                                        "when no catalog is given")
+    parser.add_argument("--n-topics", type=int, default=150, help="topics to fit on --works (default: 150)")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0,
+                        help="how long to wait for concurrent requests to join a batch")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info")
+    args = parser.parse_args()
+    if not args.catalog and not args.works:
+        parser.error("one of --catalog or --works is required")
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(message)s")
+    works = bookmarks.read_works(args.works) if args.works and not args.catalog else None
+    serve(args.host, args.port, args.catalog, args.n_topics, args.batch_window_ms / 1000.0, args.max_batch, works)
@@ -0,0 +1,181 @@
+import json
+import math
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from seen_works import work_id
+
+
+class TagCooccurrence:
+    """
+    Sparse tag-by-tag co-occurrence counts over a catalog of works, with PMI weights for finding
+    closely related tags.
+
+    counts[i, j] is the number of works tagged with both i and j (the diagonal holds each tag's
+    document frequency) and is accumulated as Xᵀ X over the binary works-by-tags matrix X of each
+    batch, so new works are folded in without recounting the catalog. Tags are matched
+    case-insensitively. Works are identified by their AO3 work id and counted only once.
+    """
+
+    def __init__(self, path, vocabulary, counts, n_works, work_ids):
+        self.path = path
+        self.vocabulary = vocabulary
+        self.index = {tag.lower(): i for i, tag in enumerate(vocabulary)}
+        self.counts = counts
+        self.frequencies = counts.diagonal()
+        self.n_works = n_works
+        self.work_ids = work_ids
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+    @classmethod
+    def build(cls, path, works, chunk_size=10000):
+        """Count the tags of works (dicts with "link" and "tags") into a new matrix saved in `path`."""
+        matrix = cls(path, [], sp.csr_matrix((0, 0), dtype=np.int64), 0, np.empty(0, dtype=np.int64))
+        matrix.update(works, chunk_size)
+        return matrix
+
+    @classmethod
+    def load(cls, path):
+        """Load a matrix saved by `save`, or start an empty one if `path` holds none yet."""
+        if not os.path.exists(os.path.join(path, "cooccurrence.json")):
+            return cls(path, [], sp.csr_matrix((0, 0), dtype=np.int64), 0, np.empty(0, dtype=np.int64))
+        with open(os.path.join(path, "cooccurrence.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        counts = sp.load_npz(os.path.join(path, "counts.npz")).tocsr()
+        work_ids = np.load(os.path.join(path, "work_ids.npy"))
+        return cls(path, meta["vocabulary"], counts, meta["n_works"], work_ids)
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        sp.save_npz(os.path.join(self.path, "counts.npz"), self.counts)
+        np.save(os.path.join(self.path, "work_ids.npy"), self.work_ids)
+        with open(os.path.join(self.path, "cooccurrence.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_works": self.n_works, "vocabulary": self.vocabulary}, f)
+
+    def update(self, works, chunk_size=10000):
+        """Add the co-occurrences of works not counted before, chunk_size works at a time, and save."""
+        batch = []
+        for work in works:
+            batch.append(work)
+            if len(batch) >= chunk_size:
+                self._add(batch)
+                batch = []
+        self._add(batch)
+        self.save()
+
+    def track(self, works, chunk_size=1000):
+        """
+        Yield works unchanged while counting them, chunk_size at a time, so a crawl can update
+        the matrix as it streams; the matrix is saved when the stream ends.
+        """
+        batch = []
+        try:
+            for work in works:
+                batch.append(work)
+                if len(batch) >= chunk_size:
+                    self._add(batch)
+                    batch = []
+                yield work
+        finally:
+            self._add(batch)
+            self.save()
+
+    def _add(self, works):
+        ids = set()
+        new_works = []
+        for work in works:
+            work_id_ = work_id(work.get("link"))
+            if work_id_ is not None:
+                if work_id_ in ids or self._seen(work_id_):
+                    continue
+                ids.add(work_id_)
+            new_works.append(work)
+        if not new_works:
+            return
+
+        rows, columns = [], []
+        for row, work in enumerate(new_works):
+            for folded, name in {tag.strip().lower(): tag.strip() for tag in work["tags"] if tag.strip()}.items():
+                column = self.index.get(folded)
+                if column is None:
+                    column = self.index[folded] = len(self.vocabulary)
+                    self.vocabulary.append(name)
+                rows.append(row)
+                columns.append(column)
+        n_tags = len(self.vocabulary)
+        x = sp.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)), shape=(len(new_works), n_tags))
+        counts = self.counts.copy()
+        counts.resize((n_tags, n_tags))
+        self.counts = (counts + (x.T @ x).tocsr()).tocsr()
+        self.frequencies = self.counts.diagonal()
+        self.n_works += len(new_works)
+        self.work_ids = np.union1d(self.work_ids, np.fromiter(ids, dtype=np.int64, count=len(ids)))
+
+    def _seen(self, work_id):
+        position = np.searchsorted(self.work_ids, work_id)
+        return position < len(self.work_ids) and self.work_ids[position] == work_id
+
+    def document_frequency(self, tag):
+        i = self.index.get(tag.strip().lower())
+        return 0 if i is None else int(self.frequencies[i])
+
+    def pmi(self, i, min_count=2):
+        """
+        (columns, PMI) of the tags co-occurring with tag index i in at least min_count works,
+        where PMI = log(count(i, j) * n_works / (count(i) * count(j))).
+        """
+        row = self.counts.getrow(i)
+        keep = (row.data >= min_count) & (row.indices != i)
+        columns = row.indices[keep]
+        if not len(columns):
+            return columns, np.empty(0)
+        frequencies = self.frequencies[columns].astype(np.float64)
+        scores = np.log(row.data[keep] * self.n_works / (frequencies * self.frequencies[i]))
+        return columns, scores
+
+    def related(self, tag, k=10, min_count=2):
+        """The k tags with the highest positive PMI with tag, as (tag, PMI) pairs."""
+        i = self.index.get(tag.strip().lower())
+        if i is None:
+            return []
+        columns, scores = self.pmi(i, min_count)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [(self.vocabulary[columns[j]], float(scores[j])) for j in order if scores[j] > 0]
+
+    def substitute(self, kept, dropped, exclude=(), min_count=2):
+        """
+        The tag best replacing `dropped` in a query that keeps the tags in `kept`: the tag with the
+        highest positive PMI with dropped among those co-occurring with every kept tag in at least
+        min_count works, favouring tags also associated with the kept ones. Tags in kept or exclude
+        are never chosen. None if there is no such tag.
+        """
+        i = self.index.get(dropped.strip().lower())
+        if i is None:
+            return None
+        columns, scores = self.pmi(i, min_count)
+        if not len(columns):
+            return None
+        scores = scores.copy()
+        excluded = {self.index.get(tag.strip().lower()) for tag in list(kept) + list(exclude)}
+        for tag in kept:
+            k = self.index.get(tag.strip().lower())
+            if k is None:
+                return None
+            together = np.asarray(self.counts[k, columns].todense()).ravel()
+            with np.errstate(divide="ignore"):
+                association = np.log(together * self.n_works / (self.frequencies[columns] * float(self.frequencies[k])))
+            # A kept tag rarely seen with the candidate would make the search come back short again
+            scores[together < min_count] = -math.inf
+            scores += np.maximum(association, 0) / max(len(kept), 1)
+        best = None
+        for j in np.argsort(-scores, kind="stable"):
+            if scores[j] <= 0 or not math.isfinite(scores[j]):
+                break
+            if columns[j] not in excluded:
+                best = self.vocabulary[columns[j]]
+                break
+        return best
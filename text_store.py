@@ -0,0 +1,188 @@
+import gzip
+import json
+import os
+import re
+from html.parser import HTMLParser
+
+# Tags whose start or end breaks the text into a new line
+BLOCK_TAGS = {"p", "br", "div", "li", "blockquote", "hr", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "pre"}
+
+WHITESPACE = re.compile(r"\s+")
+
+
+class TextStore:
+    """
+    Compressed store of full work texts in `directory`, with random access by work id.
+
+    Every work is one file of concatenated gzip members, one per chapter, so it decompresses as a
+    single text stream while any chapter can be read alone by seeking to its member. A small JSON
+    sidecar records each chapter's title, offset and sizes. Files are spread over 1000 shard
+    directories and written through a temporary file, so a failed download never leaves a
+    partial work behind.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, work_id, suffix):
+        return os.path.join(self.directory, f"{work_id % 1000:03d}", f"{work_id}{suffix}")
+
+    def __contains__(self, work_id):
+        return os.path.exists(self._path(work_id, ".json"))
+
+    def writer(self, work_id):
+        """A WorkWriter that stores work_id's chapters when it is closed without an error."""
+        return WorkWriter(self._path(work_id, ".txt.gz"), self._path(work_id, ".json"), work_id)
+
+    def chapters(self, work_id):
+        """The stored chapters of work_id: dicts with "title", "offset", "length" (compressed) and "size"."""
+        with open(self._path(work_id, ".json"), encoding="utf-8") as f:
+            return json.load(f)["chapters"]
+
+    def open(self, work_id):
+        """The whole text of work_id as a text stream, decompressed as it is read."""
+        return gzip.open(self._path(work_id, ".txt.gz"), "rt", encoding="utf-8")
+
+    def chapter_text(self, work_id, chapter):
+        """The text of one chapter (numbered from 0), read and decompressed on its own."""
+        entry = self.chapters(work_id)[chapter]
+        with open(self._path(work_id, ".txt.gz"), "rb") as f:
+            f.seek(entry["offset"])
+            return gzip.decompress(f.read(entry["length"])).decode("utf-8")
+
+    def work_ids(self):
+        """Every stored work id, shard by shard."""
+        if not os.path.isdir(self.directory):
+            return
+        for shard in sorted(os.listdir(self.directory)):
+            shard_dir = os.path.join(self.directory, shard)
+            if os.path.isdir(shard_dir):
+                for name in sorted(os.listdir(shard_dir)):
+                    if name.endswith(".json"):
+                        yield int(name[:-len(".json")])
+
+
+class WorkWriter:
+    """Streams one work's chapters into a TextStore; use as a context manager."""
+
+    def __init__(self, path, meta_path, work_id, compresslevel=6):
+        self.path = path
+        self.meta_path = meta_path
+        self.work_id = work_id
+        self.compresslevel = compresslevel
+        self.chapters = []
+        self._file = None
+        self._member = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path + ".tmp", "wb")
+        return self
+
+    def start_chapter(self, title=""):
+        self.end_chapter()
+        self.chapters.append({"title": title, "offset": self._file.tell(), "length": 0, "size": 0})
+        self._member = gzip.GzipFile(fileobj=self._file, mode="wb", compresslevel=self.compresslevel, mtime=0)
+
+    def write(self, text):
+        if self._member is None:
+            self.start_chapter()
+        data = text.encode("utf-8")
+        self._member.write(data)
+        self.chapters[-1]["size"] += len(data)
+
+    def end_chapter(self):
+        if self._member is not None:
+            # Closing the member flushes its gzip trailer but leaves the file open for the next one
+            self._member.close()
+            self._member = None
+            self.chapters[-1]["length"] = self._file.tell() - self.chapters[-1]["offset"]
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.end_chapter()
+        finally:
+            self._file.close()
+        if exc_type is not None or not self.chapters:
+            os.remove(self.path + ".tmp")
+            return
+        os.replace(self.path + ".tmp", self.path)
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"work_id": self.work_id, "chapters": self.chapters}, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+
+class ChapterTextParser(HTMLParser):
+    """
+    Incremental parser for an AO3 full-work page (view_full_work=true): feed it the page in pieces
+    and the text of each chapter's div.userstuff under div#chapters is written to a WorkWriter as
+    it is parsed, one chapter per userstuff block, titled by the preceding h3.title. Only the
+    current tag depth and title are kept, never the page.
+    """
+
+    def __init__(self, writer):
+        super().__init__(convert_charrefs=True)
+        self.writer = writer
+        self._depth = 0
+        self._chapters_depth = None
+        self._text_depth = None
+        self._skip_depth = None
+        self._title_depth = None
+        self._title = []
+        self._newline = True
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        if tag == "div":
+            self._depth += 1
+            if attrs.get("id") == "chapters":
+                self._chapters_depth = self._depth
+            elif self._chapters_depth is not None and self._text_depth is None and "userstuff" in classes:
+                self._text_depth = self._depth
+                self.writer.start_chapter(WHITESPACE.sub(" ", "".join(self._title)).strip())
+                self._title = []
+                self._newline = True
+                return
+        if self._text_depth is not None:
+            if tag == "h3" and "landmark" in classes and self._skip_depth is None:
+                # The hidden "Chapter Text" heading
+                self._skip_depth = self._depth
+            elif tag in BLOCK_TAGS:
+                self._line_break()
+        elif self._chapters_depth is not None and tag == "h3" and "title" in classes:
+            self._title_depth = self._depth
+            self._title = []
+
+    def handle_endtag(self, tag):
+        if self._text_depth is not None and tag in BLOCK_TAGS:
+            self._line_break()
+        if tag == "h3":
+            self._skip_depth = None
+            self._title_depth = None
+        if tag != "div":
+            return
+        if self._text_depth == self._depth:
+            self._text_depth = None
+            self.writer.end_chapter()
+        if self._chapters_depth == self._depth:
+            self._chapters_depth = None
+        self._depth -= 1
+
+    def handle_data(self, data):
+        if self._title_depth is not None:
+            self._title.append(data)
+            return
+        if self._text_depth is None or self._skip_depth is not None:
+            return
+        text = WHITESPACE.sub(" ", data)
+        if self._newline:
+            text = text.lstrip()
+        if text:
+            self.writer.write(text)
+            self._newline = False
+
+    def _line_break(self):
+        if not self._newline:
+            self.writer.write("\n")
+            self._newline = True
@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+
+
+class TopicIndex:
+    """
+    Approximate nearest-neighbour index over LDA topic vectors using random-hyperplane LSH.
+
+    Every vector is hashed into one bucket per table by the sign of its projection onto
+    n_bits random hyperplanes. A query only scores the vectors that share a bucket with it
+    (plus a few neighbouring buckets when n_probes > 1), then re-ranks those by cosine similarity.
+
+    Recall/latency trade-offs:
+      - more tables (n_tables) raise recall at the cost of build time and index size
+      - more bits per table (n_bits) make buckets smaller and queries faster, but lower recall
+      - more probes per table (n_probes) raise recall at query time without rebuilding
+    """
+
+    def __init__(self, path, planes, center, codes, order, vectors):
+        self.path = path
+        self.planes = planes
+        self.center = center
+        self.codes = codes
+        self.order = order
+        self.vectors = vectors
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @staticmethod
+    def _project(planes, center, vectors):
+        # (n_tables, n_items, n_bits) signed distances to each hyperplane
+        return np.einsum("tbd,md->tmb", planes, vectors - center, optimize=True)
+
+    @staticmethod
+    def _pack(projections):
+        n_bits = projections.shape[-1]
+        weights = (1 << np.arange(n_bits, dtype=np.uint32)).astype(np.uint32)
+        return ((projections > 0).astype(np.uint32) * weights).sum(axis=-1, dtype=np.uint32)
+
+    @classmethod
+    def build(cls, path, chunks, n_items, n_dims, n_tables=8, n_bits=12, seed=42, dtype=np.float16):
+        """
+        Build an index in `path` from an iterable of (m, n_dims) arrays.
+        Vectors are written straight to a memory-mapped file chunk by chunk, so only one chunk
+        and the bucket codes (n_tables * n_items * 4 bytes) are held in memory at a time.
+        """
+        if n_bits > 32:
+            raise ValueError("n_bits must be at most 32")
+        os.makedirs(path, exist_ok=True)
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((n_tables, n_bits, n_dims)).astype(np.float32)
+        # Topic mixtures all live on the simplex, so centre them before hashing
+        center = np.full(n_dims, 1.0 / n_dims, dtype=np.float32)
+
+        vectors = np.lib.format.open_memmap(
+            os.path.join(path, "vectors.npy"), mode="w+", dtype=dtype, shape=(n_items, n_dims)
+        )
+        codes = np.empty((n_tables, n_items), dtype=np.uint32)
+        start = 0
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=np.float32)
+            end = start + chunk.shape[0]
+            if end > n_items:
+                raise ValueError(f"Received more than n_items={n_items} vectors")
+            vectors[start:end] = chunk
+            codes[:, start:end] = cls._pack(cls._project(planes, center, chunk))
+            start = end
+        if start != n_items:
+            raise ValueError(f"Expected {n_items} vectors, received {start}")
+        vectors.flush()
+
+        order = np.argsort(codes, axis=1, kind="stable").astype(np.uint32)
+        sorted_codes = np.take_along_axis(codes, order.astype(np.intp), axis=1)
+        np.savez(os.path.join(path, "lsh.npz"), planes=planes, center=center, codes=sorted_codes, order=order)
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump({"n_items": n_items, "n_dims": n_dims, "n_tables": n_tables, "n_bits": n_bits}, f)
+        del vectors
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index built with `build`; vectors stay memory-mapped on disk."""
+        with np.load(os.path.join(path, "lsh.npz")) as data:
+            planes = data["planes"]
+            center = data["center"]
+            codes = data["codes"]
+            order = data["order"]
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        return cls(path, planes, center, codes, order, vectors)
+
+    def _candidates(self, query, n_probes):
+        projections = self._project(self.planes, self.center, query[None, :])[:, 0, :]
+        codes = self._pack(projections)
+        # Probe the exact bucket first, then flip the bits whose hyperplanes the query is closest to
+        flip_order = np.argsort(np.abs(projections), axis=1)
+        found = []
+        for t in range(self.codes.shape[0]):
+            probes = [codes[t]]
+            for b in flip_order[t, : max(n_probes - 1, 0)]:
+                probes.append(codes[t] ^ np.uint32(1 << int(b)))
+            table_codes = self.codes[t]
+            for probe in probes:
+                lo = np.searchsorted(table_codes, probe, side="left")
+                hi = np.searchsorted(table_codes, probe, side="right")
+                if hi > lo:
+                    found.append(self.order[t, lo:hi])
+        if not found:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        rows, hits = np.unique(np.concatenate(found), return_counts=True)
+        return rows.astype(np.intp), hits
+
+    def query(self, vector, k=10, n_probes=1, max_candidates=None, exclude=None):
+        """
+        Return up to k (row, cosine similarity) pairs nearest to `vector`, best first.
+        If the probed buckets hold fewer than k usable rows, neighbouring buckets are probed
+        until enough are found or every single-bit neighbour has been tried.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        n_bits = self.planes.shape[1]
+        exclude = np.asarray(sorted(exclude), dtype=np.intp) if exclude else None
+
+        probes = max(n_probes, 1)
+        while True:
+            candidates, hits = self._candidates(query, probes)
+            if exclude is not None and len(candidates):
+                keep = ~np.isin(candidates, exclude)
+                candidates, hits = candidates[keep], hits[keep]
+            if len(candidates) >= k or probes > n_bits:
+                break
+            probes = min(probes * 2, n_bits + 1)
+
+        if max_candidates is not None and len(candidates) > max_candidates:
+            # Keep the rows that collided with the query in the most tables
+            keep = np.argsort(-hits, kind="stable")[:max_candidates]
+            candidates = np.sort(candidates[keep])
+        if len(candidates) == 0:
+            return []
+
+        vectors = np.asarray(self.vectors[candidates], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+        scores = vectors @ query / np.where(norms == 0, 1.0, norms)
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
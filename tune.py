@@ -0,0 +1,236 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+import bookmarks
+import evaluate
+
+# Settings searched by default; every combination is one candidate configuration
+DEFAULT_GRID = {
+    "n_topics": [20, 50, 100, 150],
+    "min_df": [1, 2],
+    "max_df": [1.0, 0.8],
+    "sublinear_tf": [False, True],
+    "n_query_tags": [3, 4, 5],
+    "n_search_topics": [2, 3, 5],
+}
+
+# Grid keys passed to the tag TfidfVectorizer rather than to the recommender
+VECTORIZER_SETTINGS = ("min_df", "max_df", "sublinear_tf", "norm", "use_idf", "smooth_idf")
+
+# Works per AO3 search result page, as fetched by the recommender
+PAGE_SIZE = 20
+
+_corpora = {}
+
+
+def vectorize_corpus(path, stamp):
+    """
+    The corpus' binary (works x tags) matrix, kudos and hashed summaries, computed once and cached
+    on disk by joblib.Memory; `stamp` (file size and mtime) invalidates the cache when the file changes.
+    """
+    import numpy as np
+    from sklearn.feature_extraction.text import CountVectorizer
+    works = list(bookmarks.read_works(path))
+    vectorizer = CountVectorizer(tokenizer=bookmarks.split_tags, token_pattern=None, binary=True)
+    tags = vectorizer.fit_transform([", ".join(work["tags"]) for work in works]).tocsc()
+    return {
+        "works": works,
+        "tags": tags,
+        "vocabulary": vectorizer.vocabulary_,
+        "kudos": np.array([work["kudos"] for work in works], dtype=np.float64),
+        "summaries": bookmarks.hash_summaries(works).tocsr(),
+    }
+
+
+def load_corpus(path, cache_dir):
+    """The vectorized corpus from the joblib cache, memoized per process."""
+    from joblib import Memory
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _corpora:
+        cached = Memory(cache_dir, verbose=0).cache(vectorize_corpus)
+        _corpora[key] = cached(key[0], key[1:])
+    return _corpora[key]
+
+
+def search_corpus(corpus, tags, exclude, limit):
+    """Rows of corpus works tagged with all of tags, most kudos first, like an AO3 tag search."""
+    import numpy as np
+    matrix = corpus["tags"]
+    rows = None
+    for tag in tags:
+        column = corpus["vocabulary"].get(tag)
+        if column is None:
+            return []
+        tagged = matrix.indices[matrix.indptr[column]:matrix.indptr[column + 1]]
+        rows = tagged if rows is None else np.intersect1d(rows, tagged, assume_unique=True)
+    if rows is None or not len(rows):
+        return []
+    rows = rows[np.argsort(-corpus["kudos"][rows], kind="stable")]
+    return [row for row in rows.tolist() if row not in exclude][:limit]
+
+
+def search_ladder(corpus, tags, exclude, pool_size, max_pages):
+    """Offline collect_search_ladder: drop the lowest-weighted tag until pool_size works are found."""
+    found = []
+    seen = set()
+    for drop in range(len(tags)):
+        for row in search_corpus(corpus, tags[:len(tags) - drop], exclude, max_pages * PAGE_SIZE):
+            if row not in seen:
+                seen.add(row)
+                found.append(row)
+        if len(found) >= pool_size:
+            break
+    return found[:pool_size]
+
+
+def recommend_offline(corpus, works, config, k, pool_size=100, max_pages=3):
+    """
+    recommend_works_by_tags with its tag searches answered from the corpus: fit the reader's
+    profile with the configuration's settings, search each topic query's ladder, merge and re-rank.
+    """
+    import numpy as np
+    settings = bookmarks.load_tuned_config(config)
+    profile = bookmarks.build_tag_profile(works, settings["n_topics"],
+                                          vectorizer_options=settings["vectorizer_options"])
+    if profile is None:
+        return []
+    query_weights = bookmarks.topic_queries(profile["topics"], profile, settings["n_search_topics"],
+                                            settings["n_query_tags"])
+    links = {work["link"] for work in works}
+    exclude = {row for row, work in enumerate(corpus["works"]) if work["link"] in links}
+    result_lists = [[dict(corpus["works"][row], row=row)
+                     for row in search_ladder(corpus, query, exclude, pool_size, max_pages)]
+                    for query in query_weights]
+    candidates = bookmarks.merge_round_robin(result_lists, list(query_weights.values()), pool_size)
+    if not candidates:
+        return []
+    rows = np.array([work["row"] for work in candidates])
+    return bookmarks.rerank_candidates(candidates, profile, k, summaries=corpus["summaries"][rows])
+
+
+def run_config(path, cache_dir, config, lists, folds, k):
+    """Leave-one-out results (held-out link, recommended links, seconds) for one configuration."""
+    corpus = load_corpus(path, cache_dir)
+    results = []
+    for list_index, held_out in folds:
+        works = lists[list_index]
+        remaining = works[:held_out] + works[held_out + 1:]
+        start = time.perf_counter()
+        recommendations = recommend_offline(corpus, remaining, config, k)
+        results.append((works[held_out]["link"], [work["link"] for work in recommendations],
+                        time.perf_counter() - start))
+    return results
+
+
+def make_configs(grid, trials=None, seed=42):
+    """Every combination of the grid's values (or a random sample of `trials` of them) as tuned settings."""
+    names = list(grid)
+    combinations = list(itertools.product(*(grid[name] for name in names)))
+    if trials is not None and trials < len(combinations):
+        combinations = random.Random(seed).sample(combinations, trials)
+    configs = []
+    for values in combinations:
+        values = dict(zip(names, values))
+        config = {"n_topics": 150, "n_search_topics": 3, "n_query_tags": 5, "vectorizer_options": {}}
+        for name, value in values.items():
+            if name in VECTORIZER_SETTINGS:
+                config["vectorizer_options"][name] = value
+            else:
+                config[name] = value
+        configs.append(config)
+    return configs
+
+
+def tune(path, lists=None, grid=None, trials=None, ks=(10,), objective=None, n_jobs=None,
+         max_folds_per_list=None, min_list_size=2, cache_dir=None, seed=42):
+    """
+    Score candidate recommender settings by leave-one-out on reading lists (by default, the corpus'
+    works grouped by collection), with tag searches answered offline from the corpus at `path`.
+    The corpus is vectorized once and cached; configurations are evaluated in parallel across n_jobs
+    joblib workers. Returns the best settings (by `objective`, default nDCG at the largest k) with
+    every trial's scores.
+    """
+    from joblib import Parallel, delayed
+    cache_dir = cache_dir or os.path.join(bookmarks.CACHE_DIR, "tune")
+    corpus = load_corpus(path, cache_dir)
+    links = {work["link"] for work in corpus["works"]}
+    lists = list(evaluate.group_lists(lists if lists is not None else corpus["works"], min_list_size).values())
+    folds = evaluate.make_folds(lists, links, max_folds_per_list, seed)
+    if not folds:
+        raise ValueError("No reading list has a held-out work in the corpus.")
+    configs = make_configs(grid or DEFAULT_GRID, trials, seed)
+    objective = objective or f"ndcg@{max(ks)}"
+
+    start = time.perf_counter()
+    outcomes = Parallel(n_jobs=n_jobs or -1)(
+        delayed(run_config)(path, cache_dir, config, lists, folds, max(ks)) for config in configs)
+    trials = [{**config, **evaluate.score(results, ks, len(corpus["works"]))}
+              for config, results in zip(configs, outcomes)]
+    trials.sort(key=lambda trial: trial[objective], reverse=True)
+    return {
+        **bookmarks.load_tuned_config(trials[0]),
+        "objective": objective,
+        "score": trials[0][objective],
+        "corpus": path,
+        "reading_lists": len(lists),
+        "folds": len(folds),
+        "seconds": time.perf_counter() - start,
+        "trials": trials,
+    }
+
+
+def format_table(report, ks):
+    columns = [f"recall@{k}" for k in ks] + [f"ndcg@{k}" for k in ks]
+    lines = [f"{'topics':>7}{'tags':>6}{'queries':>9}  {'vectorizer':<44}"
+             + "".join(f"{column:>11}" for column in columns)]
+    for trial in report["trials"]:
+        options = ", ".join(f"{name}={value}" for name, value in sorted(trial["vectorizer_options"].items()))
+        lines.append(f"{trial['n_topics']:>7}{trial['n_query_tags']:>6}{trial['n_search_topics']:>9}  {options:<44}"
+                     + "".join(f"{trial[column]:>11.3f}" for column in columns))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Search recommender settings (topics, TF-IDF cutoffs, query sizes) by offline leave-one-out.")
+    parser.add_argument("works", help="NDJSON corpus of works (e.g. `bookmarks.py crawl` output)")
+    parser.add_argument("-o", "--output", default="tuned_config.json",
+                        help="where the best settings are written (default: tuned_config.json)")
+    parser.add_argument("--lists", help="NDJSON reading lists grouped by 'reader' or 'collection' "
+                                        "(default: the corpus' own collections)")
+    parser.add_argument("--grid", help="JSON file mapping settings to lists of values (default: built-in grid)")
+    parser.add_argument("--trials", type=int, default=None, help="evaluate a random sample of this many combinations")
+    parser.add_argument("-k", type=int, nargs="+", default=[10], help="cutoffs for recall and nDCG")
+    parser.add_argument("--objective", help="metric to maximize (default: ndcg at the largest k)")
+    parser.add_argument("--jobs", type=int, default=None, help="parallel workers (default: one per CPU)")
+    parser.add_argument("--max-folds-per-list", type=int, default=None,
+                        help="hold out at most this many works per list")
+    parser.add_argument("--cache-dir", help="where the vectorized corpus is cached "
+                                            "(default: the search cache directory)")
+    parser.add_argument("--format", choices=["json", "table"], default="table")
+    args = parser.parse_args()
+
+    grid = None
+    if args.grid:
+        with open(args.grid, encoding="utf-8") as f:
+            grid = json.load(f)
+    ks = sorted(args.k)
+    if args.objective and args.objective not in [f"{metric}@{k}" for metric in ("recall", "ndcg") for k in ks]:
+        parser.error(f"--objective must be recall@k or ndcg@k for one of -k {' '.join(map(str, ks))}")
+    lists = list(bookmarks.read_works(args.lists)) if args.lists else None
+    report = tune(args.works, lists, grid, args.trials, ks, args.objective, args.jobs, args.max_folds_per_list,
+                  cache_dir=args.cache_dir)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if args.format == "table":
+        print(format_table(report, ks))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    print(f"Best {report['objective']} {report['score']:.3f}; settings written to {args.output}", file=sys.stderr)